@@ -0,0 +1,106 @@
+# 可预订索引的搜索耗时基准测试
+# 用法: python benchmarks/bench_availability.py [房屋数量], 不传时使用数据库中最大的房屋id
+# 依次向索引中写入1万到1000万条订单, 每个规模下测量按入住日期搜索一次的平均耗时:
+# 从索引中合并冲突房屋的耗时, 以及房屋列表接口用NOT IN排除这些房屋后查询第一页的耗时
+# 合并索引只涉及区间内每天的集合, 耗时应当与订单总数无关, 只随区间天数和当天被预订的房屋数变化
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ihome import create_app
+
+app = create_app("dev")
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from ihome import db, sr
+from ihome.models import House
+from ihome.modules.api.house import HOUSE_LIST_SORT_RULES
+from ihome.utils import availability, constants
+
+# 使用单独的键前缀, 避免污染线上索引和预订日历
+constants.HOUSE_BOOKED_DAY_REDIS_PREFIX = "bench_house_booked_day_"
+constants.HOUSE_CALENDAR_REDIS_PREFIX = "bench_house_calendar_"
+
+ORDER_COUNTS = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+# 每天新增的订单数, 订单表随时间增长, 每天的预订密度保持不变
+ORDERS_PER_DAY = 2000
+# 每个规模下的搜索次数
+SEARCH_TIMES = 200
+
+
+def fill(house_count, start, stop, today):
+    """写入编号为[start, stop)的订单, 第i条订单从第i // ORDERS_PER_DAY天开始入住"""
+    pl = sr.pipeline(transaction=False)
+    for i in range(start, stop):
+        begin_date = today + datetime.timedelta(days=i // ORDERS_PER_DAY)
+        end_date = begin_date + datetime.timedelta(days=random.randint(1, 7))
+        availability.mark_booked(random.randint(1, house_count), begin_date, end_date, pl)
+        if i % 5000 == 0:
+            pl.execute()
+    pl.execute()
+
+
+def query_house_page(booked_house_ids):
+    """与房屋列表接口按入住日期搜索时相同的查询: 排除冲突房屋后按默认排序查询第一页"""
+    sort_column, sort_desc = HOUSE_LIST_SORT_RULES["new"]
+    sort_rules = [column.desc() if sort_desc else column.asc() for column in (sort_column, House.id)]
+    query = House.query.options(joinedload(House.area), joinedload(House.user)).order_by(*sort_rules)
+    if booked_house_ids:
+        query = query.filter(House.id.notin_(booked_house_ids))
+    query.paginate(1, constants.HOUSE_LIST_PER_PAGE, False)
+    db.session.rollback()
+
+
+def search(order_count, today):
+    """
+    在已写入订单的日期范围内随机搜索一周
+    :return: (平均冲突房屋数, 合并索引的平均耗时, 列表查询的平均耗时), 耗时单位为毫秒
+    """
+    days_span = order_count // ORDERS_PER_DAY
+    booked_count = 0
+    index_time = 0
+    query_time = 0
+    for _ in range(SEARCH_TIMES):
+        sd = today + datetime.timedelta(days=random.randrange(days_span))
+        begin = time.time()
+        booked_house_ids = availability.booked_house_ids(sd, sd + datetime.timedelta(days=7))
+        index_time += time.time() - begin
+
+        begin = time.time()
+        query_house_page(booked_house_ids)
+        query_time += time.time() - begin
+        booked_count += len(booked_house_ids)
+    return (booked_count / SEARCH_TIMES, index_time * 1000 / SEARCH_TIMES,
+            query_time * 1000 / SEARCH_TIMES)
+
+
+def main():
+    if len(sys.argv) > 1:
+        house_count = int(sys.argv[1])
+    else:
+        house_count = db.session.query(func.max(House.id)).scalar() or 100000
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    written = 0
+    print("%12s %12s %14s %14s %12s" % ("订单数", "冲突房屋数", "合并索引(ms)", "列表查询(ms)", "合计(ms)"))
+    try:
+        for order_count in ORDER_COUNTS:
+            fill(house_count, written, order_count, today)
+            written = order_count
+            booked_count, index_time, query_time = search(order_count, today)
+            print("%12d %12d %14.3f %14.3f %12.3f" % (
+                order_count, booked_count, index_time, query_time, index_time + query_time))
+    finally:
+        for prefix in (constants.HOUSE_BOOKED_DAY_REDIS_PREFIX, constants.HOUSE_CALENDAR_REDIS_PREFIX):
+            for key in sr.scan_iter(match=prefix + "*", count=1000):
+                sr.delete(key)
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        main()
@@ -4,3 +4,9 @@ bind = "0.0.0.0:5000"    # 监听IP放宽，以便于Docker之间、Docker和宿
 daemon = False  # 是否守护进程
 
 
+def post_worker_init(worker):
+    """工作进程启动后, 开启后台协程: 提前重建即将过期的热点缓存, 订阅进程内缓存的失效通知"""
+    from main import app
+    from ihome.utils import cache
+    cache.start_refresher(app)
+    cache.start_invalidation_listener(app)
@@ -2,8 +2,9 @@
 #ihome所使用的所有模型
 
 from datetime import datetime
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
-from ihome.utils import constants
+from ihome.utils import constants, pagination
 from . import db
 
 
@@ -87,27 +88,42 @@ class House(BaseModel, db.Model):
     """房屋信息"""
 
     __tablename__ = "ih_house_info"
+    __table_args__ = (
+        # 按城区筛选并排序的房屋列表
+        db.Index("ix_ih_house_info_area_id_price", "area_id", "price"),
+        db.Index("ix_ih_house_info_area_id_order_count", "area_id", "order_count"),
+        db.Index("ix_ih_house_info_area_id_acreage", "area_id", "acreage"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 房屋编号
-    user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 房屋主人的用户编号
+    user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False, index=True)  # 房屋主人的用户编号
     area_id = db.Column(db.Integer, db.ForeignKey("ih_area_info.id"), nullable=False)  # 归属地的区域编号
     title = db.Column(db.String(64), nullable=False)  # 标题
-    price = db.Column(db.Integer, default=0)  # 单价，单位：分
+    price = db.Column(db.Integer, default=0, index=True)  # 单价，单位：分
     address = db.Column(db.String(512), default="")  # 地址
     room_count = db.Column(db.Integer, default=1)  # 房间数目
-    acreage = db.Column(db.Integer, default=0)  # 房屋面积
+    acreage = db.Column(db.Integer, default=0, index=True)  # 房屋面积
     unit = db.Column(db.String(32), default="")  # 房屋单元， 如几室几厅
     capacity = db.Column(db.Integer, default=1)  # 房屋容纳的人数
     beds = db.Column(db.String(64), default="")  # 房屋床铺的配置
     deposit = db.Column(db.Integer, default=0)  # 房屋押金
     min_days = db.Column(db.Integer, default=1)  # 最少入住天数
     max_days = db.Column(db.Integer, default=0)  # 最多入住天数，0表示不限制
-    order_count = db.Column(db.Integer, default=0)  # 预订完成的该房屋的订单数
+    order_count = db.Column(db.Integer, default=0, index=True)  # 预订完成的该房屋的订单数
     index_image_url = db.Column(db.String(256), default="")  # 房屋主图片的路径
+    facility_bits = db.Column(db.BigInteger, default=0)  # 房屋设施位图，第(设施编号-1)位为1表示有该设施
     facilities = db.relationship("Facility", secondary=house_facility)  # 房屋的设施
     images = db.relationship("HouseImage")  # 房屋的图片
     orders = db.relationship("Order", backref="house")  # 房屋的订单
 
+    @staticmethod
+    def facility_mask(facility_ids):
+        """将设施编号列表转换为设施位图"""
+        mask = 0
+        for facility_id in facility_ids:
+            mask |= 1 << (int(facility_id) - 1)
+        return mask
+
     def to_basic_dict(self):
         """将基本信息转换为字典数据"""
         house_dict = {
@@ -156,20 +172,18 @@ class House(BaseModel, db.Model):
             facilities.append(facility.id)
         house_dict["facilities"] = facilities
 
-        # 评论信息
-        comments = []
-        orders = Order.query.filter(Order.house_id == self.id, Order.status == "COMPLETE", Order.comment != None) \
-            .order_by(Order.update_time.desc()).limit(constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS)
-        for order in orders:
-            comment = {
-                "comment": order.comment,  # 评论的内容
-                "user_name": order.user.name if order.user.name != order.user.mobile else "匿名用户",  # 发表评论的用户
-                "ctime": order.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
-            }
-            comments.append(comment)
+        # 评论信息(第一页), 后续的评论通过comments_cursor分页查询
+        comments, comments_cursor = Order.get_comments(self.id)
         house_dict["comments"] = comments
+        house_dict["comments_cursor"] = comments_cursor
         return house_dict
 
+    @classmethod
+    def get_detail(cls, house_id):
+        """查询房屋, 并一次性关联查询房主, 图片和设施, 供to_full_dict使用"""
+        return cls.query.options(joinedload(cls.user), selectinload(cls.images), selectinload(cls.facilities)) \
+            .filter(cls.id == house_id).first()
+
 
 class Facility(BaseModel, db.Model):
     """设施信息"""
@@ -194,6 +208,14 @@ class Order(BaseModel, db.Model):
     """订单"""
 
     __tablename__ = "ih_order_info"
+    __table_args__ = (
+        # 按房屋和日期检查预订冲突
+        db.Index("ix_ih_order_info_house_id_begin_date_end_date", "house_id", "begin_date", "end_date"),
+        # 按下单时间倒序分页查询房客的订单
+        db.Index("ix_ih_order_info_user_id_create_time", "user_id", "create_time"),
+        # 按状态和下单时间查询过期未处理的订单
+        db.Index("ix_ih_order_info_status_create_time", "status", "create_time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)  # 订单编号
     user_id = db.Column(db.Integer, db.ForeignKey("ih_user_profile.id"), nullable=False)  # 下订单的用户编号
@@ -213,22 +235,63 @@ class Order(BaseModel, db.Model):
             "CANCELED",  # 已取消
             "REJECTED"  # 已拒单
         ),
-        default="WAIT_ACCEPT", index=True)
+        default="WAIT_ACCEPT")
     comment = db.Column(db.Text)  # 订单的评论信息或者拒单原因
 
-    def to_dict(self):
-        """将订单信息转换为字典数据"""
+    @classmethod
+    def get_comments(cls, house_id, before=None, limit=constants.HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS):
+        """
+        按评价时间倒序查询房屋的一页评论, 评论用户通过关联查询一并取出
+        :param before: 游标, 为None时从最新的评论开始查询
+        :return: (评论字典列表, 下一页的游标), 没有下一页时游标为None
+        """
+        query = cls.query.options(joinedload(cls.user)) \
+            .filter(cls.house_id == house_id, cls.status == "COMPLETE", cls.comment != None)
+        if before:
+            update_time, order_id = pagination.decode_cursor(before)
+            update_time = datetime.strptime(update_time, "%Y-%m-%d %H:%M:%S.%f")
+            query = query.filter(pagination.after_cursor([cls.update_time, cls.id], [update_time, order_id], True))
+        orders = query.order_by(cls.update_time.desc(), cls.id.desc()).limit(limit + 1).all()
+
+        comments = []
+        for order in orders[:limit]:
+            comment = {
+                "comment": order.comment,  # 评论的内容
+                "user_name": order.user.name if order.user.name != order.user.mobile else "匿名用户",  # 发表评论的用户
+                "ctime": order.update_time.strftime("%Y-%m-%d %H:%M:%S")  # 评价的时间
+            }
+            comments.append(comment)
+
+        next_cursor = None
+        if len(orders) > limit:
+            last_order = orders[limit - 1]
+            next_cursor = pagination.encode_cursor(
+                [last_order.update_time.strftime("%Y-%m-%d %H:%M:%S.%f"), last_order.id])
+        return comments, next_cursor
+
+    @staticmethod
+    def format_dict(order, title, index_image_url):
+        """
+        将订单信息转换为字典数据
+        :param order: 订单对象, 或者包含订单同名字段的查询结果行
+        :param title: 房屋标题
+        :param index_image_url: 房屋主图片地址
+        """
         order_dict = {
-            "order_id": self.id,
-            "title": self.house.title,
-            "img_url": constants.QINIU_DOMIN_PREFIX + self.house.index_image_url if self.house.index_image_url else "",
-            "start_date": self.begin_date.strftime("%Y-%m-%d"),
-            "end_date": self.end_date.strftime("%Y-%m-%d"),
-            "ctime": self.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "days": self.days,
-            "amount": self.amount,
-            "status": self.status,
-            "comment": self.comment if self.comment else ""
+            "order_id": order.id,
+            "title": title,
+            "img_url": constants.QINIU_DOMIN_PREFIX + index_image_url if index_image_url else "",
+            "start_date": order.begin_date.strftime("%Y-%m-%d"),
+            "end_date": order.end_date.strftime("%Y-%m-%d"),
+            "ctime": order.create_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "days": order.days,
+            "amount": order.amount,
+            "status": order.status,
+            "comment": order.comment if order.comment else ""
         }
         return order_dict
 
+    def to_dict(self):
+        """将订单信息转换为字典数据"""
+        return self.format_dict(self, self.house.title, self.house.index_image_url)
+
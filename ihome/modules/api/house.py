@@ -1,14 +1,16 @@
 import datetime
+import json
 
 from flask import current_app, jsonify, request, g, session
-from sqlalchemy import or_, and_
+from sqlalchemy import cast, func
+from sqlalchemy.orm import joinedload
 
 from ihome import sr, db
-from ihome.models import Area, House, Facility, HouseImage, Order
+from ihome.models import House, HouseImage, Order, house_facility
 from ihome.modules.api import api_blu
-from ihome.utils import constants
-from ihome.utils.common import login_required
-from ihome.utils.constants import AREA_INFO_REDIS_EXPIRES, QINIU_DOMIN_PREFIX, HOUSE_LIST_PAGE_CAPACITY, \
+from ihome.utils import constants, availability, pagination, house_list_index, search_index, cache, catalog
+from ihome.utils.common import login_required, ndjson_response
+from ihome.utils.constants import QINIU_DOMIN_PREFIX, HOUSE_LIST_PAGE_CAPACITY, \
     HOME_PAGE_MAX_HOUSES, HOME_PAGE_DATA_REDIS_EXPIRES
 from ihome.utils.image_storage import storage_image
 from ihome.utils.response_code import RET
@@ -27,7 +29,8 @@ def get_user_house_list():
     user_id = g.user_id
 
     try:
-        houses = House.query.filter(House.user_id == user_id).all()
+        houses = House.query.options(joinedload(House.area), joinedload(House.user)) \
+            .filter(House.user_id == user_id).all()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="查询数据失败")
@@ -42,28 +45,25 @@ def get_user_house_list():
 @api_blu.route("/areas")
 def get_areas():
     """
-    1. 查询出所有的城区
-    2. 返回
+    1. 从本进程的目录中取出预先序列化好的城区列表
+    2. 客户端支持gzip时直接返回预先压缩好的内容
     :return:
     """
-    # 查询所有城区数据
     try:
-        area = Area.query.all()
+        area_catalog = catalog.get_catalog()
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg='查询数据异常')
-    # 将城区对象数据列表转换成字典列表
-    area_list = []
-    for a in area if area else []:
-        area_list.append(a.to_dict())
 
-    # 组织返回数据
-    # data = {
-    #     'data':area_list
-    # }
-    # print(data)
-
-    return jsonify(errno=RET.OK, errmsg='查询成功', data=area_list)
+    if "gzip" in request.accept_encodings:
+        resp = current_app.response_class(area_catalog.areas_gzip, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+        etag = area_catalog.areas_etag + "-gzip"
+    else:
+        resp = current_app.response_class(area_catalog.areas_json, mimetype="application/json")
+        etag = area_catalog.areas_etag
+    resp.vary.add("Accept-Encoding")
+    return cache.conditional_response(resp, constants.AREA_INFO_CACHE_CONTROL, etag)
 
 
 # 上传房屋图片
@@ -113,6 +113,14 @@ def upload_house_image(house_id):
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(error=RET.DBERR, errmsg="保存房屋图片失败")
+
+    # 房屋图片变化, 使房屋详情缓存和房屋列表缓存失效, 设置了主图片的房屋可能进入首页, 同时使首页缓存失效
+    try:
+        cache.bump_version("house_info_%s" % house_id, "house_list")
+        cache.invalidate(constants.HOME_PAGE_DATA_REDIS_KEY)
+    except Exception as e:
+        current_app.logger.error(e)
+
     return jsonify(errno=RET.OK, errmsg="保存成功", data={"url": constants.QINIU_DOMIN_PREFIX + url})
 
 
@@ -182,10 +190,24 @@ def save_new_house():
     try:
         price = int(float(price) * 100)
         deposit = int(float(deposit) * 100)
+        area_id = int(area_id)
+        facility_ids = {int(facility_id) for facility_id in facility}
+        # 超出范围的设施编号无法写入设施位图
+        if not all(0 < facility_id <= constants.HOUSE_FACILITY_MAX_ID for facility_id in facility_ids):
+            raise ValueError("设施编号错误")
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(error=RET.PARAMERR, errmsg="参数错误")
 
+    # 城区和设施通过本进程的目录校验, 不再查询数据库
+    try:
+        house_catalog = catalog.get_catalog()
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询数据异常")
+    if area_id not in house_catalog.area_ids or not facility_ids <= house_catalog.facility_ids:
+        return jsonify(errno=RET.PARAMERR, errmsg="城区或设施不存在")
+
     house = House()
     house.user_id = user_id
     house.area_id = area_id
@@ -202,12 +224,14 @@ def save_new_house():
     house.max_days = max_days
     # house.images_url = constants.QINIU_DOMIN_PREFIX + image_name
 
-    if facility:
-        facilities = Facility.query.filter(Facility.id.in_(facility)).all()
-        house.facilities = facilities
+    house.facility_bits = House.facility_mask(facility_ids)
 
     try:
         db.session.add(house)
+        db.session.flush()
+        # 设施已经校验过, 直接写入房屋设施关系表, 不需要先查出设施对象
+        db.session.execute(house_facility.insert(),
+                           [{"house_id": house.id, "facility_id": facility_id} for facility_id in facility_ids])
         db.session.commit()
 
     except Exception as e:
@@ -215,30 +239,49 @@ def save_new_house():
         db.session.rollback()
         return jsonify(error=RET.DBERR, errmsg="保存房源信息异常")
 
+    # 将新房源加入排序索引和搜索索引, 并使房屋列表缓存失效
+    try:
+        house_list_index.add_house(house)
+        search_index.add_house(house)
+        cache.bump_version("house_list")
+    except Exception as e:
+        current_app.logger.error(e)
+
     return jsonify(errno=RET.OK, errmsg="发布房源成功", data={'house_id': house.id})
 
 
+def _build_house_detail(house_id):
+    """查询房屋详情, 返回序列化好的房屋数据, 房屋不存在时返回None"""
+    house = House.get_detail(house_id)
+    if not house:
+        return None
+    return json.dumps(house.to_full_dict())
+
+
 # 房屋详情
 @api_blu.route('/houses/<int:house_id>')
 def get_house_detail(house_id):
     """
-    1. 通过房屋id查询出房屋模型
+    1. 从缓存中取出房屋详情, 缓存键带有该房屋的版本号, 房屋图片, 信息或评论变化时版本号加1
+    2. 缓存中没有时, 通过房屋id查询出房屋模型
     :param house_id:
     :return:
     """
     user_id = session.get('user_id', None)
-    user = None
-    if user_id:
-        user = User.query.get(user_id)
     try:
-        house = House.query.filter(House.id == house_id).first()
-        # house = sr.get('house_id_%s'%house_id)
+        house_key = "house_info_%s_%s" % (house_id, cache.get_version("house_info_%s" % house_id))
+    except Exception as e:
+        current_app.logger.error(e)
+        house_key = "house_info_%s" % house_id
+    try:
+        house_json = cache.get_or_build(house_key, constants.HOUSE_DETAIL_REDIS_EXPIRE_SECOND,
+                                        lambda: _build_house_detail(house_id))
     except Exception as e:
-        return jsonify(errno=RET.SESSIONERR, errmsg='查询数据错误')
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg='查询数据错误')
 
-    if not house:
-        return jsonify(errno=RET.THIRDERR, errmsg='没有值')
-    house_dict = house.to_full_dict() if house else None
+    if not house_json:
+        return jsonify(errno=RET.NODATA, errmsg='房屋不存在')
 
     '''
     house
@@ -264,216 +307,388 @@ def get_house_detail(house_id):
     user_id
     '''
 
-    data = {
-        'house': house_dict,
-        'user_id': user_id
-    }
-
-    return jsonify(errno=RET.OK, errmsg='查询OK', data=data)
+    # 房屋数据是所有用户共用的缓存, 只在外层拼接当前用户id, 不再重复序列化房屋数据
+    resp_json = '{"errno": "%s", "errmsg": "查询OK", "data": {"house": %s, "user_id": %s}}' % (
+        RET.OK, house_json, json.dumps(user_id))
+    return cache.json_response(resp_json, constants.HOUSE_DETAIL_CACHE_CONTROL)
 
 
-# 获取首页展示内容
-@api_blu.route('/houses/index')
-def house_index():
+# 房屋评论
+@api_blu.route('/houses/<int:house_id>/comments')
+def get_house_comments(house_id):
     """
-    获取首页房屋列表
+    分页查询房屋评论, 房屋详情中只带有第一页评论
+    1. 获取参数: before 上一页返回的游标
+    2. 查询评论
+    :param house_id:
     :return:
     """
+    before = request.args.get("before")
     try:
-        # 查询房屋订单倒序排序并显示5条
-        houses = House.query.order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES).all()
+        comments, next_cursor = Order.get_comments(house_id, before)
+    except ValueError as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="查询数据异常")
+        return jsonify(errno=RET.DBERR, errmsg="查询评论异常")
 
-    if not houses:
-        return jsonify(errno=RET.NODATA, errmsg="该房子不存在")
+    return jsonify(errno=RET.OK, errmsg="OK", data={"comments": comments, "next_cursor": next_cursor})
 
-        # 将查询到的房屋信息转换成字典数据，添加到定义的houses_list列表
-    house_list = []
-    for house in houses if houses else []:
-        # 如果房屋未设置主图片，则跳过
-        if not house.index_image_url:
-            continue
-        house_list.append(house.to_basic_dict())
 
-    # 将列表数据转换从json格式的数据，并存到redis数据库中
+# 房屋预订日历
+@api_blu.route('/houses/<int:house_id>/calendar')
+def get_house_calendar(house_id):
+    """
+    查询房屋在某个月中已被预订的日期
+    1. 获取参数: month 月份, 格式为2019-01, 不传时为当月
+    2. 从预订日历位图中查询, 位图不完整或不可用时查询订单表
+    :param house_id:
+    :return:
+    """
+    month = request.args.get("month")
     try:
-        json_house = json.dumps(house_list)
-        sr.setex("house_page_data", constants.HOME_PAGE_DATA_REDIS_EXPIRES, json_house)
+        if month:
+            begin_date = datetime.datetime.strptime(month, "%Y-%m")
+        else:
+            begin_date = datetime.datetime.combine(datetime.date.today().replace(day=1), datetime.time())
     except Exception as e:
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="保存数据异常")
+        return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
+    end_date = (begin_date + datetime.timedelta(days=32)).replace(day=1)
 
-    # 因为第一次是不存在缓存数据的，所以我们在进入函数时，就先从redis中拿取数据
+    booked_days = None
     try:
-        ret = sr.get("house_page_data")
+        if availability.is_calendar_ready():
+            booked_days = availability.booked_days(house_id, begin_date, end_date)
     except Exception as e:
         current_app.logger.error(e)
-        ret = None
 
-    if not ret:
+    if booked_days is None:
         try:
-            houses = House.query.order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES).all()
+            orders = Order.query.with_entities(Order.begin_date, Order.end_date).filter(
+                Order.house_id == house_id, Order.status.in_(constants.ORDER_OCCUPY_STATUS),
+                Order.begin_date < end_date, Order.end_date > begin_date).all()
         except Exception as e:
             current_app.logger.error(e)
-            return jsonify(errno=RET.DBERR, errmsg="查询数据异常")
-
-    ret = eval(ret)
+            return jsonify(errno=RET.DBERR, errmsg="查询预订日历异常")
+        booked_days = set()
+        for order_begin_date, order_end_date in orders:
+            day = max(order_begin_date, begin_date)
+            while day < min(order_end_date, end_date):
+                booked_days.add(day)
+                day += datetime.timedelta(days=1)
+        booked_days = sorted(booked_days)
+
+    data = {"month": begin_date.strftime("%Y-%m"), "booked_days": [day.day for day in booked_days]}
+    return jsonify(errno=RET.OK, errmsg="OK", data=data)
+
+
+def _build_house_index():
+    """查询订单数最多的几个有主图片的房屋, 返回序列化好的首页响应, 没有房屋时返回None"""
+    houses = House.query.options(joinedload(House.area), joinedload(House.user)) \
+        .filter(House.index_image_url != "") \
+        .order_by(House.order_count.desc()).limit(constants.HOME_PAGE_MAX_HOUSES).all()
+    if not houses:
+        return None
 
-    return jsonify(errno=RET.OK, errmsg="ok", data=ret)
+    # 将查询到的房屋信息转换成字典数据，添加到定义的houses_list列表
+    house_list = []
+    for house in houses:
+        house_list.append(house.to_basic_dict())
+    return jsonify(errno=RET.OK, errmsg="ok", data=house_list).get_data(as_text=True)
 
 
-# 搜索房屋/获取房屋列表
-@api_blu.route('/houses')
-def get_house_list():
-    param_dict = request.args
+# 获取首页展示内容
+@api_blu.route('/houses/index')
+def house_index():
+    """
+    获取首页房屋列表
+    1. 缓存有效时直接返回序列化好的首页数据
+    2. 缓存过期时只由一个请求重新查询, 其余请求继续返回旧数据
+    3. 请求带有If-None-Match且与当前内容的ETag一致时返回304
+    :return:
+    """
+    try:
+        resp_json = cache.get_or_build(constants.HOME_PAGE_DATA_REDIS_KEY, constants.HOME_PAGE_DATA_REDIS_EXPIRES,
+                                       _build_house_index)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.DBERR, errmsg="查询数据异常")
 
-    # 先设置一个初始的page和per_page
-    page = 1
-    per_page = 100
+    if not resp_json:
+        return jsonify(errno=RET.NODATA, errmsg="该房子不存在")
 
-    # 设置一个列表来装排序条件
-    sort_rule = House.acreage.desc()
+    return cache.json_response(resp_json, constants.HOUSE_INDEX_CACHE_CONTROL)
 
-    # 设置一个列表来装房屋查询条件
-    house_filter_list = []
 
-    # 2.根据参数情况处理不同的业务逻辑
-    print(param_dict)
+# 房屋列表的排序方式: sk -> (排序字段, 是否倒序)
+HOUSE_LIST_SORT_RULES = {
+    "new": (House.acreage, True),
+    "booking": (House.order_count, True),
+    "price-inc": (House.price, False),
+    "price-des": (House.price, True),
+}
 
-    if not (param_dict.get("aid") or param_dict.get("sd") or param_dict.get("ed")):
 
-        # 没有任何查询条件时,快速的返回响应,提升用户体验
-        try:
-            paginate = House.query.filter(*house_filter_list).order_by(
-                sort_rule).paginate(page, per_page, False)
-            house_list = paginate.items
-            total_page = paginate.pages
+def _get_house_page_from_index(aid, sk, page, cursor_values, per_page):
+    """
+    从Redis排序索引中查询一页房屋
+    :param cursor_values: 游标中的(排序字段值, 房屋id), 为None时按页码查询
+    :return: (房屋列表, 总页数, 是否有下一页), 索引未建立时返回(None, None, None)
+    """
+    if not house_list_index.is_ready():
+        return None, None, None
+
+    sort_column, sort_desc = HOUSE_LIST_SORT_RULES[sk]
+    if cursor_values:
+        house_ids = house_list_index.get_after(aid, sort_column.key, sort_desc, cursor_values[0], cursor_values[1],
+                                               per_page + 1)
+        has_next = len(house_ids) > per_page
+        house_ids = house_ids[:per_page]
+        total_page = None
+    else:
+        house_ids, total_page = house_list_index.get_page(aid, sort_column.key, sort_desc, page, per_page)
+        has_next = page < total_page
+
+    # 按索引中的顺序回表查询
+    houses = House.query.options(joinedload(House.area), joinedload(House.user)) \
+        .filter(House.id.in_(house_ids)).all() if house_ids else []
+    house_dict = {house.id: house for house in houses}
+    house_list = [house_dict[house_id] for house_id in house_ids if house_id in house_dict]
+    return house_list, total_page, has_next
+
+
+def _get_house_list_facets(aid, house_filter_list):
+    """
+    用一次分组查询统计房屋数量: 各城区的数量, 以及所选城区下各价格区间和各房间数的数量
+    统计各城区数量时不使用城区条件, 前端可以直接展示切换到其他城区后的结果数
+    :param house_filter_list: 不包含城区条件的查询条件
+    """
+    bounds = constants.HOUSE_LIST_PRICE_FACET_BOUNDS
+    # 价格和房间数只有Python端的默认值, 数据库中可能为NULL, 按各自的默认值统计
+    price = func.coalesce(House.price, 0)
+    room_count = func.coalesce(House.room_count, 1)
+    # 价格区间编号 = 价格达到的分界值个数, 价格单位为分
+    price_bucket = sum(cast(price >= bound * 100, db.Integer) for bound in bounds)
+    rows = db.session.query(House.area_id, price_bucket, room_count, func.count(House.id)) \
+        .filter(*house_filter_list).group_by(House.area_id, price_bucket, room_count).all()
+
+    edges = [0] + list(bounds) + [""]
+    price_labels = ["%s-%s" % (edges[i], edges[i + 1]) for i in range(len(bounds) + 1)]
+
+    area_counts = {}
+    price_counts = {label: 0 for label in price_labels}
+    room_counts = {}
+    for area_id, bucket, room_count, count in rows:
+        area_counts[area_id] = area_counts.get(area_id, 0) + count
+        if aid and str(area_id) != str(aid):
+            continue
+        price_counts[price_labels[bucket]] += count
+        room_counts[room_count] = room_counts.get(room_count, 0) + count
+    return {"area": area_counts, "price": price_counts, "room_count": room_counts}
 
-        except Exception as e:
-            current_app.logger.error(e)
-            return jsonify(errno=RET.DBERR, errmsg="查询房屋分页对象异常")
 
-        # 将房屋分页对象列表转换为房屋分页对象字典列表
-        house_dict_list = []
-        for house in house_list if house_list else []:
-            house_dict_list.append(house.to_basic_dict())
-        data = {"houses": house_dict_list, "total_page": total_page}
-        return jsonify(errno=RET.OK, errmsg="成功", data=data)
-
-    if param_dict.get("p"):
-        page = int(param_dict.get("p"))
-    if param_dict.get("aid"):
-        aid = param_dict.get("aid")
-        house_filter_list.append(House.area_id == aid)
+# 搜索房屋/获取房屋列表
+@api_blu.route('/houses')
+def get_house_list():
+    """
+    1. 获取参数: aid 城区id, sd 入住日期, ed 离开日期, sk 排序方式, p 页码, cursor 游标, q 关键词,
+       facets 为1时返回分面统计, facility 以逗号分隔的设施编号, stream 为1时不分页, 以NDJSON流式返回全部结果
+    2. 根据入住日期, 从可预订索引中排除日期冲突的房屋, 根据关键词从倒排索引中查出匹配的房屋,
+       根据设施位图筛选同时具备所选设施的房屋
+    3. 按需统计各城区, 各价格区间和各房间数的房屋数量
+    4. 按排序方式分页查询, 传了cursor时使用游标分页, 否则按页码分页
+    5. 返回, 请求带有If-None-Match且与当前内容的ETag一致时返回304
+    :return:
+    """
+    param_dict = request.args
+    aid = param_dict.get("aid")
+    sd = param_dict.get("sd")
+    ed = param_dict.get("ed")
+    sk = param_dict.get("sk")
+    cursor = param_dict.get("cursor")
+    facets = param_dict.get("facets") == "1"
+    stream = param_dict.get("stream") == "1"
+    # 关键词切分后的词, 排序后用于缓存键, 保证等价的关键词命中同一份缓存
+    q_tokens = sorted(search_index.tokenize(param_dict.get("q"), for_query=True))
+    if sk not in HOUSE_LIST_SORT_RULES:
+        sk = "new"
 
-    if param_dict.get("sk"):
-        if param_dict.get("sk") == "booking":
-            sort_rule = House.order_count.desc()
-        if param_dict.get("sk") == "price-inc":
-            sort_rule = House.price.asc()
-        if param_dict.get("sk") == "price-des":
-            sort_rule = House.price.desc()
-
-    if param_dict.get("sd") and param_dict.get("ed"):
-        sd = param_dict.get("sd")
-        ed = param_dict.get("ed")
-        print(sd)
-        print(ed)
+    # 先设置一个初始的page和per_page
+    per_page = constants.HOUSE_LIST_PER_PAGE
+    try:
+        # 页码小于1时按第1页处理, 与数据库分页的行为一致
+        page = max(int(param_dict.get("p", 1)), 1)
+        if cursor:
+            # 游标中第一个值是排序方式, 换了排序方式的游标不能继续使用
+            cursor_values = pagination.decode_cursor(cursor)
+            if len(cursor_values) != 3 or cursor_values.pop(0) != sk:
+                raise ValueError("游标与排序方式不匹配")
+        # 所选设施的位图
+        facility_ids = [int(facility_id) for facility_id in param_dict.get("facility", "").split(",") if facility_id]
+        if not all(0 < facility_id <= constants.HOUSE_FACILITY_MAX_ID for facility_id in facility_ids):
+            raise ValueError("设施编号错误")
+        facility_mask = House.facility_mask(facility_ids)
+        sd = datetime.datetime.strptime(sd, "%Y-%m-%d") if sd else None
+        ed = datetime.datetime.strptime(ed, "%Y-%m-%d") if ed else None
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
+
+    # 只传入住日期时查询入住当晚, 只传离开日期时查询离开前一晚
+    if sd and not ed:
+        ed = sd + datetime.timedelta(days=1)
+    elif ed and not sd:
+        sd = ed - datetime.timedelta(days=1)
+    if sd and sd >= ed:
+        return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
+
+    # 先查询结果缓存, 缓存键由规范化后的查询条件和当前版本号组成(流式返回不使用缓存)
+    query_cond = "%s_%s_%s_%s_%s" % (aid or "", sd.strftime("%Y%m%d") if sd else "",
+                                     ed.strftime("%Y%m%d") if ed else "", " ".join(q_tokens), facility_mask or "")
+    cache_key = None
+    version = None
+    if not stream:
         try:
-            sd = datetime.datetime.strptime(sd, "%Y-%m-%d")
-            ed = datetime.datetime.strptime(ed, "%Y-%m-%d")
-            print(1)
+            version = cache.get_version("house_list")
+            cache_key = "house_list_%s_%s_%s_%s%s" % (
+                version, query_cond, sk, "c" + cursor if cursor else "p%d" % page, "_f" if facets else "")
+            resp_json = sr.get(cache_key)
         except Exception as e:
             current_app.logger.error(e)
-            return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
+            resp_json = None
+        if resp_json:
+            return cache.json_response(resp_json, constants.HOUSE_LIST_CACHE_CONTROL)
+
+    # 设置一个列表来装房屋查询条件(城区条件最后加入, 统计各城区的房屋数量时不使用城区条件)
+    house_filter_list = []
+
+    if sd:
+        # 在[sd, ed)内有时间冲突的房屋id集合
+        booked_house_ids = None
         try:
-            if Order.query.all():
-                # orders = Order.query.filter(sd <= Order.begin_date < ed or sd < Order.end_date < ed or (
-                #         Order.begin_date <= sd and Order.end_date >= ed)).all()
-                print(sd)
-                print(ed)
-                print(Order.begin_date)
-                # 冲突订单
-                orders = Order.query.filter(
-                    or_(sd <= Order.begin_date, Order.begin_date < ed, sd < Order.end_date, Order.end_date < ed, and_(
-                        Order.begin_date <= sd, Order.end_date >= ed))).all()
+            if availability.is_ready():
+                booked_house_ids = availability.booked_house_ids(sd, ed)
         except Exception as e:
             current_app.logger.error(e)
-            return jsonify(errno=RET.DBERR, errmsg="查询房屋分页对象异常")
-        # 有时间冲突的所有房屋id列表
-        nagtive_house_id_list = [order.house_id for order in orders if orders]
-        house_filter_list.append((House.id.notin_(nagtive_house_id_list)))
-
-    elif param_dict.get("sd"):
-        sd = param_dict.get("sd")
+        if booked_house_ids is None:
+            # 可预订索引不完整或不可用时, 退回到数据库中查询冲突订单
+            conflict_house_ids = db.session.query(Order.house_id).filter(
+                Order.status.in_(constants.ORDER_OCCUPY_STATUS), Order.begin_date < ed, Order.end_date > sd)
+            house_filter_list.append(House.id.notin_(conflict_house_ids))
+        elif booked_house_ids:
+            house_filter_list.append(House.id.notin_(booked_house_ids))
+
+    if q_tokens:
+        matched_house_ids = None
         try:
-            sd = datetime.datetime.strptime(sd, "%Y-%m-%d")
+            if search_index.is_ready():
+                matched_house_ids = search_index.search(param_dict.get("q"))
         except Exception as e:
             current_app.logger.error(e)
-            return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
-        # 有时间冲突的所有订单列表(此时将Order.begin_date和Order.end_date固定)
-        """
-        1.sd < Order.begin_date  不冲突
-        2.sd = Order.begin_date  冲突
-        3.Order.begin_date < sd < Order.end_date 冲突
-        4.sd = Order.end_date 不冲突
-        5.sd > Order.end_date 不冲突
-        """
+        if matched_house_ids is None:
+            # 搜索索引重建中或不可用时不退回到LIKE模糊查询: 全表扫描代价高, 且匹配结果与索引不一致
+            return jsonify(errno=RET.SERVERERR, errmsg="搜索服务暂不可用, 请稍后再试")
+        house_filter_list.append(House.id.in_(matched_house_ids))
+
+    # 同时具备所选设施: 设施位图与所选设施位图按位与之后仍等于所选设施位图
+    if facility_mask:
+        house_filter_list.append(House.facility_bits.op("&")(facility_mask) == facility_mask)
+
+    # 分面统计, 同一查询条件的各页共用一份缓存
+    facet_dict = None
+    if facets and not stream:
+        facet_key = "house_facets_%s_%s" % (version, query_cond)
         try:
-            orders = Order.query.filter(Order.begin_date <= sd < Order.end_date).all()
+            facet_json = sr.get(facet_key) if version else None
         except Exception as e:
             current_app.logger.error(e)
-            return jsonify(errno=RET.DBERR, errmsg="查询房屋分页对象异常")
-            # 有时间冲突的所有房屋id列表
-        nagtive_house_id_list = [order.house_id for order in orders if orders]
-        house_filter_list.append((House.id.notin_(nagtive_house_id_list)))
+            facet_json = None
+
+        if facet_json:
+            facet_dict = json.loads(facet_json)
+        else:
+            try:
+                facet_dict = _get_house_list_facets(aid, house_filter_list)
+            except Exception as e:
+                current_app.logger.error(e)
+                return jsonify(errno=RET.DBERR, errmsg="统计房屋数量异常")
+            try:
+                if version:
+                    sr.setex(facet_key, constants.HOUSE_LIST_REDIS_EXPIRES, json.dumps(facet_dict))
+            except Exception as e:
+                current_app.logger.error(e)
+
+    if aid:
+        house_filter_list.append(House.area_id == aid)
 
-    elif param_dict.get("ed"):
-        ed = param_dict.get("ed")
+    # 排序字段和方向, 以House.id作为相同值时的排序依据, 保证顺序稳定
+    sort_column, sort_desc = HOUSE_LIST_SORT_RULES[sk]
+    sort_columns = [sort_column, House.id]
+    if sort_desc:
+        sort_rules = [column.desc() for column in sort_columns]
+    else:
+        sort_rules = [column.asc() for column in sort_columns]
+
+    # 流式返回: 不分页, 逐批读取数据库游标, 边查询边返回
+    if stream:
+        query = House.query.options(joinedload(House.area), joinedload(House.user)) \
+            .filter(*house_filter_list).order_by(*sort_rules) \
+            .execution_options(stream_results=True).yield_per(constants.STREAM_YIELD_PER)
+        return ndjson_response(house.to_basic_dict() for house in query)
+
+    # 没有日期, 关键词和设施条件时, 先从Redis排序索引中取出一页房屋id, 只回表查询这一页的房屋
+    house_list = None
+    if not (sd or q_tokens or facility_mask):
         try:
-            ed = datetime.datetime.strptime(ed, "%Y-%m-%d")
+            house_list, total_page, has_next = _get_house_page_from_index(
+                aid, sk, page, cursor_values if cursor else None, per_page)
         except Exception as e:
             current_app.logger.error(e)
-            return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
-        # 有时间冲突的所有订单列表(此时将Order.begin_date和Order.end_date固定)
-        """
-        1.ed < Order.begin_date  不冲突
-        2.ed = Order.begin_date  不冲突
-        3.Order.begin_date < ed < Order.end_date 冲突
-        4.ed = Order.end_date 不冲突
-        5.ed > Order.end_date 不冲突
-        """
+            house_list = None
+
+    if house_list is None:
+        # 预先关联查询城区和房主, 避免to_basic_dict中逐个房屋懒加载
+        query = House.query.options(joinedload(House.area), joinedload(House.user)) \
+            .filter(*house_filter_list).order_by(*sort_rules)
         try:
-            orders = Order.query.filter(Order.begin_date < ed < Order.end_date).all()
+            if cursor:
+                # 游标分页: 从上一页最后一条数据之后开始查询, 多查一条用于判断是否还有下一页
+                house_list = query.filter(pagination.after_cursor(sort_columns, cursor_values, sort_desc)) \
+                    .limit(per_page + 1).all()
+                has_next = len(house_list) > per_page
+                house_list = house_list[:per_page]
+                total_page = None
+            else:
+                # 兼容旧客户端的页码分页
+                paginate = query.paginate(page, per_page, False)
+                house_list = paginate.items
+                total_page = paginate.pages
+                has_next = page < total_page
         except Exception as e:
             current_app.logger.error(e)
             return jsonify(errno=RET.DBERR, errmsg="查询房屋分页对象异常")
-        nagtive_house_id_list = [order.house_id for order in orders if orders]
-        house_filter_list.append((House.id.notin_(nagtive_house_id_list)))
 
-    try:
-        # print(*house_filter_list)
-        # print(sort_rule)
-        # paginate = House.query.filter(*house_filter_list).order_by(
-        #     sort_rule).paginate(page, per_page, False)
-        # print(paginate)
-        # house_list = paginate.items
-        # total_page = paginate.pages
-        paginate = House.query.filter(*house_filter_list).order_by(
-            sort_rule).paginate(page, per_page, False)
-        house_list = paginate.items
-        total_page = paginate.pages
-    except Exception as e:
-        print("error")
-        current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="查询房屋分页对象异常")
+    # 下一页的游标
+    next_cursor = None
+    if has_next and house_list:
+        last_house = house_list[-1]
+        next_cursor = pagination.encode_cursor([sk, getattr(last_house, sort_column.key), last_house.id])
 
     # 将房屋分页对象列表转换为房屋分页对象字典列表
     house_dict_list = []
     for house in house_list if house_list else []:
         house_dict_list.append(house.to_basic_dict())
-    data = {"houses": house_dict_list, "total_page": total_page}
-    return jsonify(errno=RET.OK, errmsg="成功", data=data)
+    data = {"houses": house_dict_list, "total_page": total_page, "next_cursor": next_cursor}
+    if facets:
+        data["facets"] = facet_dict
+    resp = jsonify(errno=RET.OK, errmsg="成功", data=data)
 
+    # 缓存序列化好的结果
+    if cache_key:
+        try:
+            sr.setex(cache_key, constants.HOUSE_LIST_REDIS_EXPIRES, resp.get_data(as_text=True))
+        except Exception as e:
+            current_app.logger.error(e)
+    return cache.conditional_response(resp, constants.HOUSE_LIST_CACHE_CONTROL)
@@ -1,25 +1,77 @@
 import datetime
+import time
+from collections import OrderedDict
 
 from ihome import db, sr
-from ihome.models import House, Order, User
-from ihome.utils.common import login_required
+from ihome.models import House, Order
+from ihome.utils import availability, house_list_index, cache, constants, pagination
+from ihome.utils.common import login_required, ndjson_response
 from ihome.utils.response_code import RET
 from . import api_blu
 from flask import request, g, jsonify, current_app
 
 
+# 幂等记录中表示第一次请求仍在处理的占位值, 处理完成后替换为响应内容
+_IDEMPOTENCY_PENDING = "pending"
+
+
 # 预订房间
 @api_blu.route('/orders', methods=['POST'])
 @login_required
 def add_order():
+    """
+    下单, 支持通过请求头Idempotency-Key避免网络重试时重复下单
+    1. 没有Idempotency-Key时直接下单
+    2. Redis中已有该Key的响应时直接返回, 不再访问数据库
+    3. 用SET NX写入占位记录, 只有写入成功的请求下单, 同时到达的重复请求等待其结果
+    4. 下单后保存响应内容, 数据库异常时删除占位记录, 允许客户端重试
+    :return:
+    """
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if not idempotency_key:
+        return _add_order()
+    if len(idempotency_key) > 64:
+        return jsonify(errno=RET.PARAMERR, errmsg="Idempotency-Key过长")
+    redis_key = "%s%s_%s" % (constants.ORDER_IDEMPOTENCY_REDIS_PREFIX, g.user_id, idempotency_key)
+
+    try:
+        resp_json = sr.get(redis_key)
+        # 没有记录时写入占位记录, 写入成功的请求负责下单
+        locked = resp_json is None and sr.set(redis_key, _IDEMPOTENCY_PENDING, nx=True,
+                                              ex=constants.ORDER_IDEMPOTENCY_PENDING_EXPIRES)
+        if not locked:
+            # 第一次请求仍在处理时, 等待其处理完成
+            deadline = time.time() + constants.ORDER_IDEMPOTENCY_WAIT_SECONDS
+            while resp_json in (None, _IDEMPOTENCY_PENDING) and time.time() < deadline:
+                time.sleep(0.05)
+                resp_json = sr.get(redis_key)
+            if resp_json in (None, _IDEMPOTENCY_PENDING):
+                return jsonify(errno=RET.REQERR, errmsg="请求正在处理中, 请稍后重试")
+            return cache.json_response(resp_json)
+    except Exception as e:
+        current_app.logger.error(e)
+        return _add_order()
+
+    resp = _add_order()
+    try:
+        if resp.get_json()["errno"] == RET.DBERR:
+            sr.delete(redis_key)
+        else:
+            sr.setex(redis_key, constants.ORDER_IDEMPOTENCY_REDIS_EXPIRES, resp.get_data(as_text=True))
+    except Exception as e:
+        current_app.logger.error(e)
+    return resp
+
+
+def _add_order():
     """
     下单
     1. 获取参数
     2. 校验参数
-    3. 查询指定房屋是否存在
+    3. 查询指定房屋是否存在, 同时锁住房屋记录, 同一房屋的下单请求在此排队, 避免并发下单时重复预订
     4. 判断当前房屋的房主是否是登录用户
     5. 查询当前预订时间是否存在冲突
-    6. 生成订单模型，进行下单
+    6. 生成订单模型，进行下单, 提交事务后释放房屋记录的锁
     7. 返回下单结果
     :return:
     """
@@ -41,41 +93,56 @@ def add_order():
     except Exception as e:
         current_app.logger.error(e)
         return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
-    if start_date <= end_date:
+    if start_date >= end_date:
         return jsonify(errno=RET.PARAMERR, errmsg="格式错误")
     # 预定天数
-    days = end_date - start_date
+    days = (end_date - start_date).days
 
-    # 3. 查询指定房屋是否存在
+    # 先根据预订日历位图快速判断, 位图可能残留释放失败的日期, 只相信"未被预订"的结果
+    # 位图显示已被预订时, 不加锁查询一次订单表确认, 确认冲突时不必再锁住房屋记录
     try:
-        house = House.query.get(house_id)
+        maybe_booked = availability.is_booked(house_id, start_date, end_date)
     except Exception as e:
         current_app.logger.error(e)
+        maybe_booked = False
+    if maybe_booked:
+        try:
+            conflict = _booking_conflict_exists(house_id, start_date, end_date)
+            # 结束只读事务, 之后加锁的查询才能读到最新提交的订单
+            db.session.rollback()
+        except Exception as e:
+            current_app.logger.error(e)
+            db.session.rollback()
+            return jsonify(errno=RET.DBERR, errmsg="数据库查询错误")
+        if conflict:
+            return jsonify(errno=RET.PARAMERR, errmsg="无法预定")
+        current_app.logger.warning("房屋%s的预订日历与订单表不一致, 请执行rebuild_house_calendar" % house_id)
+
+    # 3. 查询指定房屋是否存在(SELECT ... FOR UPDATE)
+    try:
+        house = House.query.filter(House.id == house_id).with_for_update().first()
+    except Exception as e:
+        current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="数据库查询错误")
     if not house:
+        db.session.rollback()
         return jsonify(errno=RET.NODATA, errmsg="无房屋可预定")
 
     # 4. 判断当前房屋的房主是否是登录用户
+    if house.user_id == user_id:
+        db.session.rollback()
+        return jsonify(errno=RET.PARAMERR, errmsg="房主是登录用户")
+
+    # 5. 查询当前预订时间是否存在冲突
     try:
-        house_user = House.query.filter(House.user_id == user_id).first()
+        conflict = _booking_conflict_exists(house.id, start_date, end_date)
     except Exception as e:
         current_app.logger.error(e)
+        db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="数据库查询错误")
-    if house_user:
-        return jsonify(errno=RET.PARAMERR, errmsg="房主是登录用户")
-
-    # 5. 查询当前预订时间是否存在冲突
-    # 查询当前房屋的所有订单
-    house_orders = house.orders
-    # i用来记录订单冲突数量
-    i = 0
-    # 对所有订单进行遍历,如果中途出现有时间冲突的,其实就可以退出了,如果一直没有碰到有时间冲突的,那么就要遍历到最后一个,确保所有的订单都没有时间冲突
-    for house_order in house_orders:
-        # 如果发生时间冲突(别人的开始时间或者结束时间在我的预定开始时间内,都是不符合的)
-        if (start_date <= house_order.begin_date < end_date) or (start_date < house_order.end_date < end_date):
-            i += 1
-            break
-    if i > 0:
+    if conflict:
+        db.session.rollback()
         return jsonify(errno=RET.PARAMERR, errmsg="无法预定")
 
     # 6. 生成订单模型，进行下单
@@ -96,82 +163,202 @@ def add_order():
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="保存数据库异常")
 
+    # 更新可预订索引和预订日历, 并使房屋列表缓存失效
+    try:
+        availability.mark_booked(house.id, start_date, end_date)
+        cache.bump_version("house_list")
+    except Exception as e:
+        current_app.logger.error(e)
+
     # 7. 返回下单结果
     data = order.id
     return jsonify(errno=RET.OK, errmsg="成功", data=data)
 
 
+# 订单列表需要的字段, 只查询这些字段, 不加载完整的订单和房屋对象
+ORDER_LIST_COLUMNS = (Order.id, House.title, House.index_image_url, Order.begin_date, Order.end_date,
+                      Order.create_time, Order.days, Order.amount, Order.status, Order.comment)
+
+
+def _order_row_to_dict(row):
+    """将ORDER_LIST_COLUMNS查询出的一行转换为字典数据, 格式与Order.to_dict相同"""
+    return Order.format_dict(row, row.title, row.index_image_url)
+
+
+def _get_order_page(query, statuses, cursor):
+    """
+    按下单时间倒序查询一页订单
+    :param query: 已关联房屋并带有角色条件的ORDER_LIST_COLUMNS查询
+    :param statuses: 订单状态列表, 为空时不限制
+    :param cursor: 上一页返回的游标, 为空时查询第一页
+    :return: (订单字典列表, 下一页的游标)
+    """
+    if statuses:
+        query = query.filter(Order.status.in_(statuses))
+    if cursor:
+        create_time, order_id = pagination.decode_cursor(cursor)
+        create_time = datetime.datetime.strptime(create_time, "%Y-%m-%d %H:%M:%S.%f")
+        query = query.filter(pagination.after_cursor([Order.create_time, Order.id], [create_time, order_id], True))
+    per_page = constants.ORDER_LIST_PAGE_CAPACITY
+    rows = query.order_by(Order.create_time.desc(), Order.id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last_row = rows[per_page - 1]
+        next_cursor = pagination.encode_cursor([last_row.create_time.strftime("%Y-%m-%d %H:%M:%S.%f"), last_row.id])
+    return [_order_row_to_dict(row) for row in rows[:per_page]], next_cursor
+
+
+def _booking_conflict_exists(house_id, start_date, end_date):
+    """
+    查询房屋是否存在与[start_date, end_date)有交集的有效订单
+    走(house_id, begin_date, end_date)索引, 耗时与房屋的历史订单数量无关
+    """
+    conflict_query = Order.query.filter(Order.house_id == house_id,
+                                        Order.status.in_(constants.ORDER_OCCUPY_STATUS),
+                                        Order.begin_date < end_date,
+                                        Order.end_date > start_date)
+    return db.session.query(conflict_query.exists()).scalar()
+
+
 # 获取我的订单
 @api_blu.route('/orders')
 @login_required
 def get_orders():
     """
-    1. 去订单的表中查询当前登录用户下的订单
-    2. 返回数据
+    1. 获取参数: role 角色, status 以逗号分隔的订单状态, cursor 上一页返回的游标,
+       stream 为1时(仅房东)不分页, 以NDJSON流式返回全部订单
+    2. 去订单的表中查询当前登录用户下的订单, 房东的订单通过关联房屋表按房屋的房东查询, 均按游标分页
+    3. 返回数据
     :return:
     """
     # 判断用户是否登录
     user_id = g.user_id
     if not user_id:
         return jsonify(errno=RET.SESSIONERR, errmsg="用户尚未登录")
-    # 根据用户id获取用户对象
-    try:
-        user = User.query.get(user_id)
-    except Exception as e:
-        current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="数据库查询错误")
-    # 判断user是否存在
-    if not user:
-        return jsonify(errno=RET.NODATA, errmsg="用户不存在")
     # 判断当前是什么角色发送请求
     role = request.args.get("role")
     if not role:
         return jsonify(errno=RET.PARAMERR, errmsg="参数不足")
     if role not in (["custom", "landlord"]):
         return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    statuses = [status for status in request.args.get("status", "").split(",") if status]
+    if not set(statuses) <= set(Order.status.type.enums):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    cursor = request.args.get("cursor")
+
     # 房客角色发送查看订单请求
     if role == "custom":
-        order_dict_list = []
-        order_list = []
-        order_list = user.orders
-        for order in order_list if order_list else []:
-            order_dict_list.append(order.to_dict())
+        # 房客的订单和订单房屋的摘要在一次关联查询中取出, 走(user_id, create_time)索引
+        order_query = db.session.query(*ORDER_LIST_COLUMNS).join(House, Order.house_id == House.id) \
+            .filter(Order.user_id == user_id)
+        try:
+            order_dict_list, next_cursor = _get_order_page(order_query, statuses, cursor)
+        except ValueError as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="数据库查询错误")
         data = {
-            "orders": order_dict_list
+            "orders": order_dict_list,
+            "next_cursor": next_cursor
         }
         return jsonify(errno=RET.OK, errmsg="ok", data=data)
     # 房东角色发送请求
     else:
-        # 用户发布的房子的id列表
-        houses_id_list = [house.id for house in user.houses]
-        # 属于该房东的订单
-        landlord_order_list = Order.query.filter(Order.house_id.in_(houses_id_list)).order_by(Order.create_time).all()
-        # 转化为字典列表
-        landlord_order_dict_list = []
-        for landlord_order in landlord_order_list if landlord_order_list else []:
-            landlord_order_dict_list.append(landlord_order.to_dict())
+        # 属于该房东的订单: orders JOIN houses WHERE houses.user_id = 当前用户
+        landlord_order_query = db.session.query(*ORDER_LIST_COLUMNS).join(House, Order.house_id == House.id) \
+            .filter(House.user_id == user_id)
+        # stream为1时逐批读取数据库游标, 以NDJSON流式返回, 订单再多内存占用也不会增长
+        if request.args.get("stream") == "1":
+            if statuses:
+                landlord_order_query = landlord_order_query.filter(Order.status.in_(statuses))
+            landlord_order_query = landlord_order_query.order_by(Order.create_time.desc(), Order.id.desc()) \
+                .execution_options(stream_results=True).yield_per(constants.STREAM_YIELD_PER)
+            return ndjson_response(_order_row_to_dict(row) for row in landlord_order_query)
+        try:
+            landlord_order_dict_list, next_cursor = _get_order_page(landlord_order_query, statuses, cursor)
+        except ValueError as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+        except Exception as e:
+            current_app.logger.error(e)
+            return jsonify(errno=RET.DBERR, errmsg="数据库查询错误")
         data = {
-            "orders": landlord_order_dict_list
+            "orders": landlord_order_dict_list,
+            "next_cursor": next_cursor
         }
         return jsonify(errno=RET.OK, errmsg="ok", data=data)
 
 
+def _change_orders_status(user_id, order_ids, action, reason=None):
+    """
+    房东接单或拒单, 单个订单和批量处理共用
+    1. 锁住请求的订单(SELECT ... FOR UPDATE), 同时查出订单所属房屋的房东, 用于给出每个订单的处理结果
+    2. 用一条带条件的UPDATE修改其中属于该房东且处于待接单状态的订单, 重复提交时不会重复修改
+    3. 提交后, 拒单的订单在可预订索引和预订日历中释放房屋日期, 并使房屋列表缓存失效
+    :param action: accept 接单, reject 拒单
+    :param reason: 拒单原因
+    :return: 每个订单的处理结果列表, 每项为{"order_id", "errno", "errmsg"}
+    """
+    rows = db.session.query(Order.id, Order.status, Order.house_id, Order.begin_date, Order.end_date, House.user_id) \
+        .join(House, Order.house_id == House.id).filter(Order.id.in_(order_ids)).with_for_update().all()
+    rows = {row.id: row for row in rows}
+    changed_ids = [order_id for order_id, row in rows.items()
+                   if row.user_id == user_id and row.status == "WAIT_ACCEPT"]
+
+    if changed_ids:
+        if action == "accept":
+            values = {Order.status: "WAIT_PAYMENT"}
+        else:
+            values = {Order.status: "REJECTED", Order.comment: reason}
+        landlord_house_ids = db.session.query(House.id).filter(House.user_id == user_id)
+        count = Order.query.filter(Order.id.in_(changed_ids), Order.status == "WAIT_ACCEPT",
+                                   Order.house_id.in_(landlord_house_ids)) \
+            .update(values, synchronize_session=False)
+        if count != len(changed_ids):
+            raise RuntimeError("订单状态已被修改: %s" % changed_ids)
+    db.session.commit()
+
+    if changed_ids and action == "reject":
+        try:
+            pl = sr.pipeline()
+            for order_id in changed_ids:
+                row = rows[order_id]
+                availability.release(row.house_id, row.begin_date, row.end_date, pl)
+            pl.execute()
+            cache.bump_version("house_list")
+        except Exception as e:
+            current_app.logger.error(e)
+
+    results = []
+    for order_id in order_ids:
+        row = rows.get(order_id)
+        if not row or row.user_id != user_id:
+            results.append({"order_id": order_id, "errno": RET.NODATA, "errmsg": "订单不存在"})
+        elif order_id not in changed_ids:
+            results.append({"order_id": order_id, "errno": RET.DATAERR, "errmsg": "订单不是待接单状态"})
+        else:
+            results.append({"order_id": order_id, "errno": RET.OK, "errmsg": "OK"})
+    return results
+
+
 # 接受/拒绝订单
 @api_blu.route('/orders', methods=["PUT"])
 @login_required
 def change_order_status():
     """
     1. 接受参数：order_id
-    2. 通过order_id找到指定的订单，(条件：status="待接单")
-    3. 修改订单状态
-    4. 保存到数据库
-    5. 返回
+    2. 通过order_id找到指定的订单，(条件：status="待接单", 且房屋属于当前房东)，修改订单状态并保存到数据库
+    3. 返回
     :return:
     """
     # 1.接受参数：order_id
     user_id = g.user_id
     action = request.json.get("action")
     order_id = request.json.get("order_id")
+    reason = request.json.get("reason")
 
     if not user_id:
         return jsonify(errno=RET.NODATA, errmsg="请登录")
@@ -180,46 +367,87 @@ def change_order_status():
         return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
     if action not in ("accept", "reject"):
         return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    if action == "reject" and not reason:
+        return jsonify(errno=RET.NODATA, errmsg="原因为空")
+    try:
+        order_id = int(order_id)
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
 
-    # 2.通过order_id找到指定的订单
-    order = None
+    # 2.修改订单状态
     try:
-        order = Order.query.filter(Order.id == order_id, Order.status == "WAIT_ACCEPT").first()
+        result = _change_orders_status(user_id, [order_id], action, reason)[0]
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="未查询到数据")
+        return jsonify(errno=RET.DBERR, errmsg="数据保存失败")
 
-    # 3. 修改订单状态
-    if action == "accept":
-        order.status = "WAIT_PAYMENT"
-    else:
-        reason = request.json.get("reason")
-        if not reason:
-            return jsonify(errno=RET.NODATA, errmsg="原因为空")
-        order.comment = reason
-        order.status = "REJECTED"
+    # 3.返回
+    return jsonify(errno=result["errno"], errmsg=result["errmsg"])
+
+
+# 批量接受/拒绝订单
+@api_blu.route('/orders/batch', methods=["PUT"])
+@login_required
+def batch_change_order_status():
+    """
+    房东批量接单或拒单
+    1. 接受参数：order_ids 订单id列表, action 接单或拒单, reason 拒单原因
+    2. 一次性修改其中属于当前房东且处于待接单状态的订单
+    3. 返回每个订单的处理结果
+    前端发送过来的json数据
+    {
+        "order_ids": [1, 2, 3],
+        "action": "reject",
+        "reason": ""
+    }
+    :return:
+    """
+    user_id = g.user_id
+    param_dict = request.json
+    action = param_dict.get("action")
+    order_ids = param_dict.get("order_ids")
+    reason = param_dict.get("reason")
 
-    # 4.保存到数据库
+    if not all([order_ids, action]):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    # order_ids必须是列表, 字符串或字典会被逐字符或按键遍历成其他订单id
+    if not isinstance(order_ids, list) or any(isinstance(order_id, bool) for order_id in order_ids):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    if action not in ("accept", "reject"):
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    if action == "reject" and not reason:
+        return jsonify(errno=RET.NODATA, errmsg="原因为空")
     try:
-        db.session.commit()
+        # 去掉重复的订单id, 保持原有顺序
+        order_ids = list(OrderedDict.fromkeys(int(order_id) for order_id in order_ids))
+    except Exception as e:
+        current_app.logger.error(e)
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
+    if len(order_ids) > constants.ORDER_BATCH_MAX_COUNT:
+        return jsonify(errno=RET.PARAMERR, errmsg="一次最多处理%d个订单" % constants.ORDER_BATCH_MAX_COUNT)
+
+    try:
+        results = _change_orders_status(user_id, order_ids, action, reason)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(e)
         return jsonify(errno=RET.DBERR, errmsg="数据保存失败")
 
-    # 5.返回
-    return jsonify(errno=RET.OK, errmsg="OK")
+    return jsonify(errno=RET.OK, errmsg="OK", data={"results": results})
 
 
 # 评论订单
 @api_blu.route('/orders/comment', methods=["PUT"])
 @login_required
-def order_comment(order_id):
+def order_comment():
     """
     订单评价
     1. 获取参数
     2. 校验参数
-    3. 修改模型
+    3. 在一个事务中用带条件的UPDATE完成订单并将房屋的订单完成数量加1, 并发提交时只有一次生效
+    4. 提交后使房屋详情, 首页和房屋列表缓存失效
     :return:
     """
     # 1.获取参数(user_id:当前登录的用户对象 comment: 评论对象)
@@ -231,39 +459,34 @@ def order_comment(order_id):
     # 非空判断
     if not comment:
         return jsonify(errno=RET.PARAMERR, errmsg="请输入评论内容")
+    if not order_id:
+        return jsonify(errno=RET.PARAMERR, errmsg="参数错误")
 
-    # 通过订单id查询出订单模型
-    # 确保用户只能评价自己的订单并且订单处于待评价状态
-    try:
-        order = Order.query.filter(Order.id == order_id, Order.status == "WAIT_COMMENT").first()
-        house = order.house
-    except Exception as e:
-        current_app.logger.error(e)
-        return jsonify(errno=RET.DBERR, errmsg="查询订单数据错误")
-
-    # 判断该订单是否存在
-    if not all([order, house]):
-        return jsonify(errno=RET.NODATA, errmsg="不存在该订单")
-
-    # 3.修改模型
-    # 将订单状态设置为完成
-    order.status = "COMPLETE"
-    # 保存订单的评价信息
-    order.comment = comment
-    # 将房屋的订单完成数量加1
-    house.order_count += 1
-
-    # 保存数据
+    # 3.修改数据
     try:
+        # 确保用户只能评价自己的订单并且订单处于待评价状态, 将订单状态设置为完成并保存评价信息
+        count = Order.query.filter(Order.id == order_id, Order.user_id == user_id, Order.status == "WAIT_COMMENT") \
+            .update({Order.status: "COMPLETE", Order.comment: comment}, synchronize_session=False)
+        if not count:
+            db.session.rollback()
+            return jsonify(errno=RET.NODATA, errmsg="不存在该订单")
+        # 将房屋的订单完成数量加1, 在数据库中计算, 不会丢失并发的更新
+        house_id = db.session.query(Order.house_id).filter(Order.id == order_id).scalar()
+        House.query.filter(House.id == house_id) \
+            .update({House.order_count: House.order_count + 1}, synchronize_session=False)
         db.session.commit()
     except Exception as e:
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="保存数据失败")
 
-    # 删除该房屋的redis缓存
+    # 4.新增了评论, 房屋的订单完成数量也发生变化, 使房屋详情, 首页和房屋列表缓存失效, 并更新该房屋在排序索引中的位置
     try:
-        sr.delete("house_info_%s" % house.id)
+        cache.bump_version("house_info_%s" % house_id, "house_list")
+        cache.invalidate(constants.HOME_PAGE_DATA_REDIS_KEY)
+        house = db.session.query(House.id, House.area_id, House.price, House.order_count, House.acreage) \
+            .filter(House.id == house_id).first()
+        house_list_index.add_house(house)
     except Exception as e:
         current_app.logger.error(e)
 
@@ -3,15 +3,20 @@ import re
 from flask import request, current_app, jsonify, session, g
 
 from ihome import db
-from ihome.models import User
+from ihome.models import User, House
 from ihome.modules.api import api_blu
-from ihome.utils import constants
+from ihome.utils import constants, cache
 from ihome.utils.common import login_required
 from ihome.utils.constants import QINIU_DOMIN_PREFIX
 from ihome.utils.image_storage import storage_image
 from ihome.utils.response_code import RET
 
 
+def _house_info_versions(user_id):
+    """用户发布的所有房屋的详情缓存版本号名称"""
+    return ["house_info_%s" % house_id for house_id, in db.session.query(House.id).filter(House.user_id == user_id)]
+
+
 # 获取用户信息
 @api_blu.route('/user')
 @login_required
@@ -88,6 +93,15 @@ def set_user_name():
         current_app.logger.error(e)
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="数据库保存错误")
+
+    # 房屋详情中展示了房主昵称, 使该用户房屋的详情缓存失效
+    try:
+        house_versions = _house_info_versions(user_id)
+        if house_versions:
+            cache.bump_version(*house_versions)
+    except Exception as e:
+        current_app.logger.error(e)
+
     return jsonify(errno=RET.OK, errmsg="修改成功")
 
 
@@ -132,6 +146,13 @@ def set_user_avatar():
         db.session.rollback()
         return jsonify(errno=RET.DBERR, errmsg="数据库提交错误")
 
+    # 首页, 房屋列表和房屋详情中展示了房主头像, 使相关缓存失效
+    try:
+        cache.bump_version("house_list", *_house_info_versions(user_id))
+        cache.invalidate(constants.HOME_PAGE_DATA_REDIS_KEY)
+    except Exception as e:
+        current_app.logger.error(e)
+
     # 4. 返回上传的结果<avatar_url>
     avatar_url = constants.QINIU_DOMIN_PREFIX + avatar_image
     data = {
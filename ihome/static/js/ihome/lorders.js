@@ -14,71 +14,95 @@ function getCookie(name) {
     return r ? r[1] : undefined;
 }
 
+var next_cursor = null;  // 下一页订单的游标, 为null时没有更多订单
+var order_data_querying = true;   // 是否正在向后台获取数据
+
+// 查询房东的订单, 传了游标时查询下一页, 拼接到当前订单列表后面
+function updateOrderData() {
+    var params = {role: "landlord"};
+    if (next_cursor) {
+        params.cursor = next_cursor;
+    }
+    $.get("/api/v1.0/orders", params, function (resp) {
+        order_data_querying = false;
+        if (resp.errno == "0") {
+            $(".orders-list").append(template("orders-list-tmpl", {"orders": resp.data.orders}))
+            next_cursor = resp.data.next_cursor;
+        }
+    })
+}
+
 $(document).ready(function(){
     $('.modal').on('show.bs.modal', centerModals);      //当模态框出现的时候
     $(window).on('resize', centerModals);
-    // 查询房东的订单
-    $.get("/api/v1.0/orders?role=landlord", function (resp) {
-        if (resp.errno == "0") {
-            $(".orders-list").html(template("orders-list-tmpl", {"orders": resp.data.orders}))
-            // 查询成功之后需要设置接单和拒单的处理
-            $(".order-accept").on("click", function(){
-                var orderId = $(this).parents("li").attr("order-id");
-                $(".modal-accept").attr("order-id", orderId);
-            });
-            $(".modal-accept").on("click", function () {
-                var orderId = $(".modal-accept").attr("order-id")
-                $.ajax({
-                    url: "/api/v1.0/orders",
-                    type: "put",
-                    contentType: "application/json",
-                    headers: {
-                        "X-CSRFToken": getCookie("csrf_token")
-                    },
-                    data: JSON.stringify({"order_id": orderId, "action": "accept"}),
-                    success: function (resp) {
-                        if (resp.errno == "0") {
-                            // 1. 设置订单状态的html
-                            $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已接单");
-                            // 2. 隐藏接单和拒单操作
-                            $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
-                            // 3. 隐藏弹出的框
-                            $("#accept-modal").modal("hide");
-                        }else{
-                            alert(resp.errmsg)
-                        }
-                    }
-                })
-            })
-            $(".order-reject").on("click", function(){
-                var orderId = $(this).parents("li").attr("order-id");
-                $(".modal-reject").attr("order-id", orderId);
-            });
-            $(".modal-reject").on("click", function () {
-                var orderId = $(".modal-reject").attr("order-id")
-                var reason = $("#reject-reason").val()
-                $.ajax({
-                    url: "/api/v1.0/orders",
-                    type: "put",
-                    contentType: "application/json",
-                    headers: {
-                        "X-CSRFToken": getCookie("csrf_token")
-                    },
-                    data: JSON.stringify({"order_id": orderId, "action": "reject", "reason": reason}),
-                    success: function (resp) {
-                        if (resp.errno == "0") {
-                            // 1. 设置订单状态的html
-                            $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已拒单");
-                            // 2. 隐藏接单和拒单操作
-                            $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
-                            // 3. 隐藏弹出的框
-                            $("#reject-modal").modal("hide");
-                        }else{
-                            alert(resp.errmsg)
-                        }
-                    }
-                })
-            })
+    // 查询房东的第一页订单
+    updateOrderData();
+    var windowHeight = $(window).height()
+    // 滚动到接近窗口底部时, 查询下一页订单
+    window.onscroll=function(){
+        var b = document.documentElement.scrollTop==0? document.body.scrollTop : document.documentElement.scrollTop;
+        var c = document.documentElement.scrollTop==0? document.body.scrollHeight : document.documentElement.scrollHeight;
+        if(c-b<windowHeight+50 && !order_data_querying && next_cursor){
+            order_data_querying = true;
+            updateOrderData();
         }
+    }
+    // 设置接单和拒单的处理, 订单分页加载, 使用事件委托使后加载的订单也生效
+    $(".orders-list").on("click", ".order-accept", function(){
+        var orderId = $(this).parents("li").attr("order-id");
+        $(".modal-accept").attr("order-id", orderId);
+    });
+    $(".modal-accept").on("click", function () {
+        var orderId = $(".modal-accept").attr("order-id")
+        $.ajax({
+            url: "/api/v1.0/orders",
+            type: "put",
+            contentType: "application/json",
+            headers: {
+                "X-CSRFToken": getCookie("csrf_token")
+            },
+            data: JSON.stringify({"order_id": orderId, "action": "accept"}),
+            success: function (resp) {
+                if (resp.errno == "0") {
+                    // 1. 设置订单状态的html
+                    $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已接单");
+                    // 2. 隐藏接单和拒单操作
+                    $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
+                    // 3. 隐藏弹出的框
+                    $("#accept-modal").modal("hide");
+                }else{
+                    alert(resp.errmsg)
+                }
+            }
+        })
+    })
+    $(".orders-list").on("click", ".order-reject", function(){
+        var orderId = $(this).parents("li").attr("order-id");
+        $(".modal-reject").attr("order-id", orderId);
+    });
+    $(".modal-reject").on("click", function () {
+        var orderId = $(".modal-reject").attr("order-id")
+        var reason = $("#reject-reason").val()
+        $.ajax({
+            url: "/api/v1.0/orders",
+            type: "put",
+            contentType: "application/json",
+            headers: {
+                "X-CSRFToken": getCookie("csrf_token")
+            },
+            data: JSON.stringify({"order_id": orderId, "action": "reject", "reason": reason}),
+            success: function (resp) {
+                if (resp.errno == "0") {
+                    // 1. 设置订单状态的html
+                    $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已拒单");
+                    // 2. 隐藏接单和拒单操作
+                    $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
+                    // 3. 隐藏弹出的框
+                    $("#reject-modal").modal("hide");
+                }else{
+                    alert(resp.errmsg)
+                }
+            }
+        })
     })
 });
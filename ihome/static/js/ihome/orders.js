@@ -14,57 +14,80 @@ function getCookie(name) {
     return r ? r[1] : undefined;
 }
 
+var next_cursor = null;  // 下一页订单的游标, 为null时没有更多订单
+var order_data_querying = true;   // 是否正在向后台获取数据
+
+// 查询房客的订单, 传了游标时查询下一页, 拼接到当前订单列表后面
+// 如果是房客，在请求订单列表的时候传：custom
+// 房东：landlord
+function updateOrderData() {
+    var params = {role: "custom"};
+    if (next_cursor) {
+        params.cursor = next_cursor;
+    }
+    $.get("/api/v1.0/orders", params, function (resp) {
+        order_data_querying = false;
+        if (resp.errno == "0") {
+            $(".orders-list").append(template("orders-list-tmpl", {"orders": resp.data.orders}))
+            next_cursor = resp.data.next_cursor;
+        }
+    })
+}
+
 $(document).ready(function(){
     $('.modal').on('show.bs.modal', centerModals);      //当模态框出现的时候
     $(window).on('resize', centerModals);
 
-    // 查询房客订单
-    // 如果是房客，在请求订单列表的时候传：custom
-    // 房东：landlord
-    $.get("/api/v1.0/orders?role=custom", function (resp) {
-        if (resp.errno == "0") {
-            $(".orders-list").html(template("orders-list-tmpl", {"orders": resp.data.orders}))
-            // 查询成功之后需要设置评论的相关处理
-            $(".order-comment").on("click", function(){
-                var orderId = $(this).parents("li").attr("order-id");
-                $(".modal-comment").attr("order-id", orderId);
-            });
-            $(".modal-comment").on('click', function () {
-                var orderId = $(this).attr("order-id")
-                var comment = $("#comment").val()
-                if (!comment) {
-                    alert("请输入评价内容")
-                    return
-                }
-
-                var params = {
-                    "order_id": orderId,
-                    "comment": comment
-                }
+    // 查询房客的第一页订单
+    updateOrderData();
+    var windowHeight = $(window).height()
+    // 滚动到接近窗口底部时, 查询下一页订单
+    window.onscroll=function(){
+        var b = document.documentElement.scrollTop==0? document.body.scrollTop : document.documentElement.scrollTop;
+        var c = document.documentElement.scrollTop==0? document.body.scrollHeight : document.documentElement.scrollHeight;
+        if(c-b<windowHeight+50 && !order_data_querying && next_cursor){
+            order_data_querying = true;
+            updateOrderData();
+        }
+    }
+    // 设置评论的相关处理, 订单分页加载, 使用事件委托使后加载的订单也生效
+    $(".orders-list").on("click", ".order-comment", function(){
+        var orderId = $(this).parents("li").attr("order-id");
+        $(".modal-comment").attr("order-id", orderId);
+    });
+    $(".modal-comment").on('click', function () {
+        var orderId = $(this).attr("order-id")
+        var comment = $("#comment").val()
+        if (!comment) {
+            alert("请输入评价内容")
+            return
+        }
 
-                $.ajax({
-                    url: "/api/v1.0/orders/comment",
-                    type: "put",
-                    data: JSON.stringify(params),
-                    contentType: "application/json",
-                    headers: {
-                        "X-CSRFToken": getCookie('csrf_token')
-                    },
-                    success: function (resp) {
-                        if (resp.errno == "0") {
-                            $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已完成");
-                            $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
-                            $("#comment-modal").modal("hide");
-                            window.location.reload()
-                        }else if (resp.errno == "4101") {
-                            location.href = "/login.html"
-                        }else {
-                            alert(resp.errmsg)
-                        }
-                    }
-                })
-            })
+        var params = {
+            "order_id": orderId,
+            "comment": comment
         }
+
+        $.ajax({
+            url: "/api/v1.0/orders/comment",
+            type: "put",
+            data: JSON.stringify(params),
+            contentType: "application/json",
+            headers: {
+                "X-CSRFToken": getCookie('csrf_token')
+            },
+            success: function (resp) {
+                if (resp.errno == "0") {
+                    $(".orders-list>li[order-id="+ orderId +"]>div.order-content>div.order-text>ul li:eq(4)>span").html("已完成");
+                    $("ul.orders-list>li[order-id="+ orderId +"]>div.order-title>div.order-operate").hide();
+                    $("#comment-modal").modal("hide");
+                }else if (resp.errno == "4101") {
+                    location.href = "/login.html"
+                }else {
+                    alert(resp.errmsg)
+                }
+            }
+        })
     })
 
 });
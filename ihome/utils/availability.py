@@ -0,0 +1,148 @@
+# 房屋可预订索引
+# 每天对应一个Redis集合, 记录当天已被预订的房屋id
+# 按入住日期搜索时只需合并[sd, ed)内每天的集合, 代价只与搜索天数和当天被预订的房屋数有关, 与订单表的大小无关
+# 另外每个房屋对应一个预订日历位图, 第n位表示HOUSE_CALENDAR_EPOCH之后第n天是否已被预订, 用于检查单个房屋的日期冲突和查询月历
+import datetime
+
+from ihome import sr
+from ihome.models import Order
+from ihome.utils import constants, redis_index
+
+
+# 可预订索引建立完成的标记, 不存在时说明索引不完整(尚未重建, Redis数据丢失或正在重建), 调用者应直接查询数据库
+READY_KEY = constants.HOUSE_BOOKED_DAY_REDIS_PREFIX + "ready"
+
+
+def _day_key(day):
+    return constants.HOUSE_BOOKED_DAY_REDIS_PREFIX + day.strftime("%Y%m%d")
+
+
+# 日历位图每次BITFIELD GET最多读取的位数(有符号整数最多64位, 无符号最多63位)
+_BITFIELD_MAX_BITS = 63
+
+_CALENDAR_EPOCH = datetime.datetime.strptime(constants.HOUSE_CALENDAR_EPOCH, "%Y-%m-%d")
+
+
+# 预订日历建立完成的标记, 不存在时月历直接查询订单表
+CALENDAR_READY_KEY = constants.HOUSE_CALENDAR_REDIS_PREFIX + "ready"
+
+
+def _calendar_key(house_id):
+    return constants.HOUSE_CALENDAR_REDIS_PREFIX + str(house_id)
+
+
+def _calendar_offsets(begin_date, end_date):
+    """[begin_date, end_date)在日历位图中的位偏移范围, 早于HOUSE_CALENDAR_EPOCH的部分忽略"""
+    begin = max((begin_date - _CALENDAR_EPOCH).days, 0)
+    end = max((end_date - _CALENDAR_EPOCH).days, 0)
+    return range(begin, end)
+
+
+def _set_calendar(house_id, begin_date, end_date, value, pipeline):
+    """将房屋日历位图中[begin_date, end_date)对应的位设置为value"""
+    for offset in _calendar_offsets(begin_date, end_date):
+        pipeline.setbit(_calendar_key(house_id), offset, value)
+
+
+def _days(begin_date, end_date):
+    """依次返回[begin_date, end_date)内今天及以后的每一天"""
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    day = max(datetime.datetime(begin_date.year, begin_date.month, begin_date.day), today)
+    while day < end_date:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def mark_booked(house_id, begin_date, end_date, pipeline=None):
+    """
+    将房屋在[begin_date, end_date)内的每一天标记为已预订
+    :param pipeline: 传入时只追加命令, 由调用者统一执行
+    """
+    pl = pipeline if pipeline is not None else sr.pipeline()
+    for day in _days(begin_date, end_date):
+        key = _day_key(day)
+        pl.sadd(key, house_id)
+        # 日期过去之后该天的索引自动过期
+        pl.expireat(key, day + datetime.timedelta(days=1))
+    _set_calendar(house_id, begin_date, end_date, 1, pl)
+    if pipeline is None:
+        pl.execute()
+
+
+def release(house_id, begin_date, end_date, pipeline=None):
+    """订单被取消或拒绝后, 释放房屋在[begin_date, end_date)内的日期"""
+    pl = pipeline if pipeline is not None else sr.pipeline()
+    for day in _days(begin_date, end_date):
+        pl.srem(_day_key(day), house_id)
+    _set_calendar(house_id, begin_date, end_date, 0, pl)
+    if pipeline is None:
+        pl.execute()
+
+
+def booked_days(house_id, begin_date, end_date):
+    """
+    从日历位图中查询房屋在[begin_date, end_date)内已被预订的日期
+    每63天合并为一次BITFIELD GET, 只需一次请求, 代价只与查询的天数有关
+    :return: 已被预订的日期列表
+    """
+    offsets = _calendar_offsets(begin_date, end_date)
+    if not offsets:
+        return []
+    bitfield = sr.bitfield(_calendar_key(house_id))
+    chunks = []
+    for start in range(offsets.start, offsets.stop, _BITFIELD_MAX_BITS):
+        bits = min(_BITFIELD_MAX_BITS, offsets.stop - start)
+        bitfield.get("u%d" % bits, start)
+        chunks.append((start, bits))
+
+    days = []
+    for (start, bits), value in zip(chunks, bitfield.execute()):
+        # 读出的整数中最高位对应start
+        for i in range(bits):
+            if value >> (bits - 1 - i) & 1:
+                days.append(_CALENDAR_EPOCH + datetime.timedelta(days=start + i))
+    return days
+
+
+def is_calendar_ready():
+    return redis_index.is_ready(CALENDAR_READY_KEY)
+
+
+def is_booked(house_id, begin_date, end_date):
+    """根据日历位图判断房屋在[begin_date, end_date)内是否至少有一天已被预订"""
+    return bool(booked_days(house_id, begin_date, end_date))
+
+
+def is_ready():
+    return redis_index.is_ready(READY_KEY)
+
+
+def booked_house_ids(begin_date, end_date):
+    """查询在[begin_date, end_date)内至少有一天已被预订的房屋id集合"""
+    keys = [_day_key(day) for day in _days(begin_date, end_date)]
+    if not keys:
+        return set()
+    return {int(house_id) for house_id in sr.sunion(keys)}
+
+
+def rebuild():
+    """
+    根据订单表重建可预订索引, 写入尚未结束的有效订单
+    :return: 写入的订单数量
+    """
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    orders = Order.query.with_entities(Order.house_id, Order.begin_date, Order.end_date) \
+        .filter(Order.status.in_(constants.ORDER_OCCUPY_STATUS), Order.end_date > today)
+    return redis_index.rebuild(constants.HOUSE_BOOKED_DAY_REDIS_PREFIX, READY_KEY, orders,
+                               lambda order, pl: mark_booked(*order, pipeline=pl))
+
+
+def rebuild_calendar():
+    """
+    根据订单表重建所有房屋的预订日历位图, 写入所有占用日期的订单
+    :return: 写入的订单数量
+    """
+    orders = Order.query.with_entities(Order.house_id, Order.begin_date, Order.end_date) \
+        .filter(Order.status.in_(constants.ORDER_OCCUPY_STATUS), Order.end_date > _CALENDAR_EPOCH)
+    return redis_index.rebuild(constants.HOUSE_CALENDAR_REDIS_PREFIX, CALENDAR_READY_KEY, orders,
+                               lambda order, pl: _set_calendar(*order, value=1, pipeline=pl))
@@ -0,0 +1,295 @@
+# 缓存工具
+# 缓存键中带上数据的版本号, 数据变化时只需将版本号加1, 不需要逐个查找和删除旧缓存
+# 读穿缓存分为两层: 每个工作进程内的LRU缓存和Redis, 数据变化时通过Redis发布订阅通知所有进程删除进程内缓存
+import random
+import time
+import uuid
+from collections import OrderedDict, Counter
+
+from flask import current_app, request
+
+from ihome import sr, db
+from ihome.utils import constants
+
+
+def get_version(name):
+    """获取指定数据的当前缓存版本号"""
+    return sr.get(constants.CACHE_VERSION_REDIS_PREFIX + name) or "0"
+
+
+def bump_version(*names):
+    """数据发生变化后, 将对应的缓存版本号加1"""
+    pl = sr.pipeline()
+    for name in names:
+        pl.incr(constants.CACHE_VERSION_REDIS_PREFIX + name)
+    pl.execute()
+
+
+class LocalCache(object):
+    """进程内的LRU缓存, 超过容量时淘汰最久未访问的条目, 条目超过有效期后失效"""
+
+    def __init__(self, max_entries, expires):
+        self.max_entries = max_entries
+        self.expires = expires
+        self._entries = OrderedDict()  # 缓存键 -> (过期时间, 值)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries[key] = (time.time() + self.expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# 进程内缓存, 只在订阅了失效通知之后启用, 否则无法得知其他进程中的数据变化
+_local = LocalCache(constants.CACHE_LOCAL_MAX_ENTRIES, constants.CACHE_LOCAL_EXPIRES)
+_local_enabled = False
+
+# 本进程内各层缓存的命中次数, 由后台协程定期累加到Redis中
+_stats = Counter()
+
+# 进程内缓存命中时各缓存键的访问次数, 同样由后台协程定期累加到访问次数统计中, 保证预热协程能找到热点缓存
+_local_access = Counter()
+
+
+def json_response(body, cache_control=None):
+    """
+    将缓存中已序列化好的JSON直接作为响应返回, 不再重复序列化
+    :param cache_control: 传入时按conditional_response处理条件请求
+    """
+    resp = current_app.response_class(body, mimetype="application/json")
+    if cache_control:
+        return conditional_response(resp, cache_control)
+    return resp
+
+
+def conditional_response(resp, cache_control, etag=None):
+    """
+    为响应加上强ETag和Cache-Control, 请求头If-None-Match与ETag一致时改为返回不带内容的304
+    :param etag: 预先计算好的ETag, 不传时使用响应内容的摘要
+    """
+    if etag:
+        resp.set_etag(etag)
+    else:
+        resp.add_etag()
+    resp.headers["Cache-Control"] = cache_control
+    return resp.make_conditional(request)
+
+
+# 释放锁时确认锁仍属于自己, 避免删除锁过期后被其他请求拿到的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _store(key, body, expires):
+    """保存数据和新鲜标记, 数据保留到过期之后一段时间, 供重建期间的其他请求使用"""
+    jitter = random.uniform(-constants.CACHE_EXPIRES_JITTER, constants.CACHE_EXPIRES_JITTER)
+    pl = sr.pipeline()
+    pl.setex(key, int(expires * constants.CACHE_STALE_FACTOR), body)
+    pl.setex(key + "_fresh", max(int(expires * (1 + jitter)), 1), 1)
+    pl.execute()
+
+
+def _rebuild(key, expires, build):
+    """
+    拿到锁后调用build重建缓存
+    :return: (是否拿到锁, 重建的数据)
+    """
+    lock_key = key + "_lock"
+    token = uuid.uuid4().hex
+    if not sr.set(lock_key, token, nx=True, ex=constants.CACHE_REBUILD_LOCK_EXPIRES):
+        return False, None
+    try:
+        body = build()
+        if body is not None:
+            _store(key, body, expires)
+        return True, body
+    finally:
+        sr.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def get_or_build(key, expires, build):
+    """
+    读穿缓存
+    1. 缓存新鲜时直接返回缓存的数据
+    2. 缓存过期或不存在时, 只有拿到锁的一个请求调用build重建, 其余请求返回旧数据, 没有旧数据时等待重建完成
+    3. Redis不可用时直接调用build
+    每次访问都会记录访问次数和重建函数, 供后台预热协程在热点缓存过期前提前重建
+    :param expires: 缓存有效期, 实际有效期在其上下随机浮动
+    :param build: 重建函数, 返回序列化好的字符串, 返回None时不缓存
+    :return: 序列化好的字符串
+    """
+    _remember_builder(key, expires, build)
+    if _local_enabled:
+        body = _local.get(key)
+        if body is not None:
+            _stats["local_hit"] += 1
+            _local_access[key] += 1
+            return body
+        _stats["local_miss"] += 1
+
+    try:
+        pl = sr.pipeline()
+        pl.get(key)
+        pl.exists(key + "_fresh")
+        pl.zincrby(constants.CACHE_ACCESS_REDIS_KEY, 1, key)
+        body, fresh, _ = pl.execute()
+        if body and fresh:
+            _stats["redis_hit"] += 1
+            if _local_enabled:
+                _local.set(key, body)
+            return body
+        _stats["redis_miss"] += 1
+        locked, new_body = _rebuild(key, expires, build)
+    except Exception as e:
+        current_app.logger.error(e)
+        return build()
+
+    if locked:
+        if _local_enabled and new_body is not None:
+            _local.set(key, new_body)
+        return new_body
+
+    # 其他请求正在重建, 先返回旧数据
+    if body:
+        return body
+    deadline = time.time() + constants.CACHE_REBUILD_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(0.05)
+        body = sr.get(key)
+        if body:
+            return body
+    return build()
+
+
+def invalidate(*keys):
+    """数据变化后使读穿缓存过期: 删除Redis中的新鲜标记, 并通知所有进程删除进程内缓存"""
+    pl = sr.pipeline()
+    for key in keys:
+        pl.delete(key + "_fresh")
+        pl.publish(constants.CACHE_INVALIDATE_CHANNEL, key)
+    pl.execute()
+    for key in keys:
+        _local.delete(key)
+
+
+# 本进程内访问过的缓存的重建函数: 缓存键 -> (有效期, 重建函数), 按最近访问顺序淘汰
+_builders = OrderedDict()
+
+
+def _remember_builder(key, expires, build):
+    _builders[key] = (expires, build)
+    _builders.move_to_end(key)
+    while len(_builders) > constants.CACHE_REFRESH_MAX_BUILDERS:
+        _builders.popitem(last=False)
+
+
+def refresh_hot_keys():
+    """
+    提前重建即将过期的热点缓存
+    1. 取出访问次数最多的缓存
+    2. 本进程知道重建方法, 且新鲜标记即将过期的, 拿到锁后重建
+    3. 访问次数减半, 使热度反映最近的访问, 多个进程中每个检查间隔只衰减一次
+    """
+    hot_keys = sr.zrevrange(constants.CACHE_ACCESS_REDIS_KEY, 0, constants.CACHE_REFRESH_HOT_KEYS - 1)
+    for key in hot_keys:
+        builder = _builders.get(key)
+        if not builder:
+            continue
+        if sr.ttl(key + "_fresh") > constants.CACHE_REFRESH_AHEAD_SECONDS:
+            continue
+        _rebuild(key, *builder)
+
+    if sr.set(constants.CACHE_ACCESS_REDIS_KEY + "_decay", 1, nx=True, ex=constants.CACHE_REFRESH_INTERVAL):
+        sr.zunionstore(constants.CACHE_ACCESS_REDIS_KEY, {constants.CACHE_ACCESS_REDIS_KEY: 0.5})
+        sr.zremrangebyscore(constants.CACHE_ACCESS_REDIS_KEY, "-inf", 0.5)
+
+
+def flush_stats():
+    """将本进程的命中次数和进程内缓存的访问次数累加到Redis中"""
+    if not _stats and not _local_access:
+        return
+    pl = sr.pipeline()
+    for name, count in _stats.items():
+        pl.hincrby(constants.CACHE_STATS_REDIS_KEY, name, count)
+    for key, count in _local_access.items():
+        pl.zincrby(constants.CACHE_ACCESS_REDIS_KEY, count, key)
+    pl.execute()
+    _stats.clear()
+    _local_access.clear()
+
+
+def get_stats():
+    """
+    汇总所有进程的缓存命中情况
+    :return: {层: (命中次数, 未命中次数, 命中率)}
+    """
+    counts = {name: int(count) for name, count in sr.hgetall(constants.CACHE_STATS_REDIS_KEY).items()}
+    stats = {}
+    for tier in ("local", "redis"):
+        hit, miss = counts.get(tier + "_hit", 0), counts.get(tier + "_miss", 0)
+        stats[tier] = (hit, miss, float(hit) / (hit + miss) if hit + miss else 0.0)
+    return stats
+
+
+def start_refresher(app):
+    """在后台协程中定期预热热点缓存并上报命中次数, 由gunicorn在每个工作进程启动后调用"""
+    import gevent
+
+    def refresh_loop():
+        with app.app_context():
+            while True:
+                gevent.sleep(constants.CACHE_REFRESH_INTERVAL)
+                try:
+                    # 先上报访问次数, 使本轮选出的热点缓存包含进程内缓存的访问
+                    flush_stats()
+                    refresh_hot_keys()
+                except Exception as e:
+                    current_app.logger.error(e)
+                finally:
+                    db.session.remove()
+
+    return gevent.spawn(refresh_loop)
+
+
+def start_invalidation_listener(app):
+    """在后台协程中订阅失效通知, 删除进程内缓存, 订阅成功后才启用进程内缓存"""
+    import gevent
+
+    def listen():
+        global _local_enabled
+        with app.app_context():
+            while True:
+                try:
+                    pubsub = sr.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(constants.CACHE_INVALIDATE_CHANNEL)
+                    _local_enabled = True
+                    for message in pubsub.listen():
+                        _local.delete(message["data"])
+                except Exception as e:
+                    current_app.logger.error(e)
+                # 连接断开期间可能错过通知, 停用并清空进程内缓存, 稍后重新订阅
+                _local_enabled = False
+                _local.clear()
+                gevent.sleep(1)
+
+    return gevent.spawn(listen)
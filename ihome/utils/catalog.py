@@ -0,0 +1,68 @@
+# 城区和设施目录
+# 城区和设施几乎不会变化, 每个工作进程只加载一次, 城区列表的响应预先序列化并压缩好, 请求时直接返回
+# 修改了城区或设施之后, 需要执行 python main.py reload_catalog 将版本号加1, 各进程检查到新版本号后重新加载
+import gzip
+import hashlib
+import time
+from collections import namedtuple
+
+from flask import current_app, jsonify
+
+from ihome.models import Area, Facility
+from ihome.utils import cache, constants
+from ihome.utils.response_code import RET
+
+# 目录数据, 加载后不再修改
+# areas_json/areas_gzip 为城区列表的响应内容和gzip压缩后的内容, areas_etag 为响应内容的摘要
+Catalog = namedtuple("Catalog", ["version", "area_ids", "facility_ids", "areas_json", "areas_gzip", "areas_etag"])
+
+_catalog = None
+# 上次检查版本号的时间
+_checked_at = 0
+
+
+def _load(version):
+    """从数据库中加载城区和设施, 生成目录"""
+    area_list = [area.to_dict() for area in Area.query.order_by(Area.id).all()]
+    facility_ids = frozenset(facility_id for facility_id, in Facility.query.with_entities(Facility.id))
+    areas_json = jsonify(errno=RET.OK, errmsg='查询成功', data=area_list).get_data()
+    return Catalog(
+        version=version,
+        area_ids=frozenset(area["aid"] for area in area_list),
+        facility_ids=facility_ids,
+        areas_json=areas_json,
+        areas_gzip=gzip.compress(areas_json, 9),
+        areas_etag=hashlib.sha1(areas_json).hexdigest(),
+    )
+
+
+def get_catalog():
+    """
+    获取本进程的目录
+    每隔CATALOG_VERSION_CHECK_INTERVAL秒检查一次Redis中的版本号, 版本号变化时才重新加载
+    Redis不可用时继续使用已加载的目录
+    """
+    global _catalog, _checked_at
+    now = time.time()
+    if _catalog is not None and now - _checked_at < constants.CATALOG_VERSION_CHECK_INTERVAL:
+        return _catalog
+    _checked_at = now
+
+    try:
+        version = cache.get_version("catalog")
+    except Exception as e:
+        current_app.logger.error(e)
+        if _catalog is not None:
+            return _catalog
+        version = None
+
+    if _catalog is None or _catalog.version != version:
+        _catalog = _load(version)
+    return _catalog
+
+
+def reload():
+    """城区或设施修改后, 通知所有进程重新加载目录"""
+    global _catalog
+    cache.bump_version("catalog")
+    _catalog = None
@@ -1,5 +1,7 @@
 import functools
-from flask import session, jsonify, g
+import json
+
+from flask import session, jsonify, g, Response, stream_with_context
 
 from ihome.utils.response_code import RET
 
@@ -20,4 +22,17 @@ def login_required(f):
             # 执行所装饰的函数并返回其响应
             return f(*args, **kwargs)
 
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+# 流式返回NDJSON(每行一个JSON对象)
+def ndjson_response(items):
+    """
+    边从可迭代对象中取出字典边序列化返回, 内存占用与数据总量无关
+    :param items: 字典的可迭代对象, 一般为对数据库游标逐条转换的生成器
+    """
+    def generate():
+        for item in items:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
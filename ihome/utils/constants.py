@@ -18,6 +18,9 @@ HOME_PAGE_MAX_HOUSES = 5
 # 首页房屋数据的Redis缓存时间，单位：秒
 HOME_PAGE_DATA_REDIS_EXPIRES = 7200
 
+# 首页房屋数据的缓存键, 缓存内容为完整的响应, 与旧版本只保存房屋列表的house_page_data区分
+HOME_PAGE_DATA_REDIS_KEY = "house_index_data"
+
 # 房屋详情页展示的评论最大数
 HOUSE_DETAIL_COMMENT_DISPLAY_COUNTS = 30
 
@@ -29,3 +32,117 @@ HOUSE_LIST_PAGE_CAPACITY = 2
 
 # 房屋列表页面Redis缓存时间，单位：秒
 HOUSE_LIST_REDIS_EXPIRES = 7200
+
+# 占用房屋日期的订单状态(已取消和已拒单的订单不占用日期)
+ORDER_OCCUPY_STATUS = ("WAIT_ACCEPT", "WAIT_PAYMENT", "PAID", "WAIT_COMMENT", "COMPLETE")
+
+# 可预订索引中每天已被预订房屋集合的Redis键前缀
+HOUSE_BOOKED_DAY_REDIS_PREFIX = "house_booked_day_"
+
+# 房屋列表排序索引(Redis有序集合)的键前缀
+HOUSE_LIST_INDEX_REDIS_PREFIX = "house_list_index_"
+
+# 房屋列表排序索引的分数 = 排序字段值 * 该系数 + 房屋id, 相同值时按房屋id排序
+HOUSE_LIST_INDEX_ID_FACTOR = 2 ** 24
+
+# 缓存版本号的Redis键前缀, 数据变化时版本号加1, 旧版本的缓存不再被读取, 等待过期
+CACHE_VERSION_REDIS_PREFIX = "cache_version_"
+
+# 房屋搜索倒排索引的Redis键前缀, 每个词对应一个包含该词的房屋id集合
+HOUSE_SEARCH_INDEX_REDIS_PREFIX = "house_search_"
+
+# 房屋列表按价格区间统计数量时的区间分界值，单位：元
+HOUSE_LIST_PRICE_FACET_BOUNDS = (100, 300, 500, 1000)
+
+# 流式返回列表数据时每次从数据库游标读取的条目数
+STREAM_YIELD_PER = 100
+
+# 读穿缓存过期后, 旧数据继续保留的时间为缓存有效期的倍数
+CACHE_STALE_FACTOR = 2
+
+# 读穿缓存有效期的随机浮动比例, 避免大量缓存同时过期
+CACHE_EXPIRES_JITTER = 0.1
+
+# 重建缓存的锁的有效期，单位：秒
+CACHE_REBUILD_LOCK_EXPIRES = 10
+
+# 没有旧数据可用时, 等待其他请求重建缓存的最长时间，单位：秒
+CACHE_REBUILD_WAIT_SECONDS = 2
+
+# 记录读穿缓存访问次数的Redis有序集合
+CACHE_ACCESS_REDIS_KEY = "cache_access"
+
+# 后台预热协程检查热点缓存的间隔，单位：秒
+CACHE_REFRESH_INTERVAL = 30
+
+# 热点缓存在过期前多少秒内由后台预热协程提前重建，需大于检查间隔
+CACHE_REFRESH_AHEAD_SECONDS = 120
+
+# 每次检查访问次数最多的缓存数量
+CACHE_REFRESH_HOT_KEYS = 20
+
+# 每个工作进程最多记录的缓存重建函数数量
+CACHE_REFRESH_MAX_BUILDERS = 1000
+
+# 进程内缓存的最大条目数
+CACHE_LOCAL_MAX_ENTRIES = 1000
+
+# 进程内缓存的有效期，单位：秒
+CACHE_LOCAL_EXPIRES = 60
+
+# 通知各进程删除进程内缓存的Redis发布订阅频道
+CACHE_INVALIDATE_CHANNEL = "cache_invalidate"
+
+# 各层缓存命中次数统计的Redis哈希
+CACHE_STATS_REDIS_KEY = "cache_stats"
+
+# 各接口响应的浏览器缓存策略, 城区信息基本不变, 允许客户端直接缓存一段时间
+AREA_INFO_CACHE_CONTROL = "public, max-age=3600"
+
+# 首页和房屋列表每次都需要向服务器确认, 数据未变化时返回304
+HOUSE_INDEX_CACHE_CONTROL = "public, no-cache"
+HOUSE_LIST_CACHE_CONTROL = "public, no-cache"
+
+# 房屋详情中带有当前登录用户的id, 只允许浏览器缓存, 不允许代理缓存
+HOUSE_DETAIL_CACHE_CONTROL = "private, no-cache"
+
+# 各进程检查城区和设施目录版本号的间隔，单位：秒
+CATALOG_VERSION_CHECK_INTERVAL = 60
+
+# 房屋预订日历位图的Redis键前缀, 每个房屋一个位图, 每一位对应一天
+HOUSE_CALENDAR_REDIS_PREFIX = "house_calendar_"
+
+# 预订日历位图第0位对应的日期, 早于该日期的订单不记入日历
+HOUSE_CALENDAR_EPOCH = "2018-01-01"
+
+# 订单列表每页显示条目数
+ORDER_LIST_PAGE_CAPACITY = 20
+
+# 批量接单或拒单时一次最多处理的订单数
+ORDER_BATCH_MAX_COUNT = 100
+
+# 待接单和待支付的订单超过该时间未处理时自动取消，单位：秒
+ORDER_STALE_SECONDS = 86400
+
+# 清理过期订单时每批处理的订单数
+ORDER_SWEEP_BATCH_SIZE = 500
+
+# 过期订单清理情况统计的Redis哈希
+ORDER_SWEEP_STATS_REDIS_KEY = "order_sweep_stats"
+
+# 下单幂等记录的Redis键前缀和有效期，单位：秒，有效期内带相同Idempotency-Key的重试直接返回第一次的结果
+ORDER_IDEMPOTENCY_REDIS_PREFIX = "order_idempotency_"
+ORDER_IDEMPOTENCY_REDIS_EXPIRES = 600
+
+# 第一次请求处理期间占位记录的有效期，以及重复请求等待第一次请求处理完成的最长时间，单位：秒
+ORDER_IDEMPOTENCY_PENDING_EXPIRES = 10
+ORDER_IDEMPOTENCY_WAIT_SECONDS = 2
+
+# 重建Redis索引时每批从数据库读取和写入Redis的行数
+REDIS_INDEX_REBUILD_BATCH_SIZE = 1000
+
+# 设施位图为有符号64位整数, 设施编号范围为1~HOUSE_FACILITY_MAX_ID
+HOUSE_FACILITY_MAX_ID = 63
+
+# 房屋列表接口每页返回的房屋数
+HOUSE_LIST_PER_PAGE = 100
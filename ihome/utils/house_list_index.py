@@ -0,0 +1,75 @@
+# 房屋列表排序索引
+# 每个城区的每个排序字段对应一个Redis有序集合, 另有一组不区分城区的集合
+# 分数为 排序字段值 * HOUSE_LIST_INDEX_ID_FACTOR + 房屋id, 相同值按房屋id排序, 与数据库中的排序规则一致
+from ihome import sr
+from ihome.models import House
+from ihome.utils import constants, redis_index
+
+# 建立索引的排序字段
+SORT_FIELDS = ("price", "order_count", "acreage")
+
+# 索引建立完成的标记, 不存在时说明索引不完整, 调用者应直接查询数据库
+READY_KEY = constants.HOUSE_LIST_INDEX_REDIS_PREFIX + "ready"
+
+
+def _key(area_id, field):
+    return constants.HOUSE_LIST_INDEX_REDIS_PREFIX + "%s_%s" % (area_id or "all", field)
+
+
+def _score(value, house_id):
+    return (value or 0) * constants.HOUSE_LIST_INDEX_ID_FACTOR + house_id
+
+
+def add_house(house, pipeline=None):
+    """
+    写入或更新房屋在各排序索引中的位置, 房屋的排序字段变化后再次调用即可
+    :param pipeline: 传入时只追加命令, 由调用者统一执行
+    """
+    pl = pipeline if pipeline is not None else sr.pipeline()
+    for field in SORT_FIELDS:
+        score = _score(getattr(house, field), house.id)
+        for area_id in (house.area_id, None):
+            pl.zadd(_key(area_id, field), {house.id: score})
+    if pipeline is None:
+        pl.execute()
+
+
+def is_ready():
+    return redis_index.is_ready(READY_KEY)
+
+
+def get_page(area_id, field, desc, page, per_page):
+    """
+    按页码取出一页房屋id
+    :return: (房屋id列表, 总页数)
+    """
+    key = _key(area_id, field)
+    start = (page - 1) * per_page
+    pl = sr.pipeline()
+    pl.zcard(key)
+    if desc:
+        pl.zrevrange(key, start, start + per_page - 1)
+    else:
+        pl.zrange(key, start, start + per_page - 1)
+    total, house_ids = pl.execute()
+    return [int(house_id) for house_id in house_ids], (total + per_page - 1) // per_page
+
+
+def get_after(area_id, field, desc, value, house_id, count):
+    """取出排在(value, house_id)之后的count个房屋id"""
+    key = _key(area_id, field)
+    score = "(%d" % _score(value, house_id)
+    if desc:
+        house_ids = sr.zrevrangebyscore(key, score, "-inf", start=0, num=count)
+    else:
+        house_ids = sr.zrangebyscore(key, score, "+inf", start=0, num=count)
+    return [int(house_id) for house_id in house_ids]
+
+
+def rebuild():
+    """
+    根据房屋表重建排序索引
+    :return: 写入的房屋数量
+    """
+    houses = House.query.with_entities(House.id, House.area_id, House.price, House.order_count, House.acreage)
+    return redis_index.rebuild(constants.HOUSE_LIST_INDEX_REDIS_PREFIX, READY_KEY, houses, add_house)
@@ -0,0 +1,83 @@
+# 过期订单清理
+# 待接单和待支付的订单超过ORDER_STALE_SECONDS未处理时自动取消, 释放房屋日期
+# 由定时任务执行 python main.py cancel_stale_orders, 每批只锁定和修改有限的订单, 不会长时间锁表
+import datetime
+import time
+
+from flask import current_app
+
+from ihome import db, sr
+from ihome.models import Order
+from ihome.utils import availability, cache, constants
+
+# 会过期的订单状态
+STALE_STATUS = ("WAIT_ACCEPT", "WAIT_PAYMENT")
+
+
+def _stale_batch_query(deadline, batch_size):
+    """
+    锁定一批下单时间早于deadline的待处理订单的查询
+    走(status, create_time)索引, 只扫描待处理的订单
+    """
+    return db.session.query(Order.id, Order.house_id, Order.begin_date, Order.end_date) \
+        .filter(Order.status.in_(STALE_STATUS), Order.create_time < deadline) \
+        .limit(batch_size).with_for_update()
+
+
+def _cancel_batch(deadline, batch_size):
+    """
+    取消一批下单时间早于deadline的订单
+    :return: 取消的订单数量
+    """
+    rows = _stale_batch_query(deadline, batch_size).all()
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    Order.query.filter(Order.id.in_([row.id for row in rows]), Order.status.in_(STALE_STATUS)) \
+        .update({Order.status: "CANCELED"}, synchronize_session=False)
+    db.session.commit()
+
+    try:
+        pl = sr.pipeline()
+        for row in rows:
+            availability.release(row.house_id, row.begin_date, row.end_date, pl)
+        pl.execute()
+        cache.bump_version("house_list")
+    except Exception as e:
+        current_app.logger.error(e)
+    return len(rows)
+
+
+def sweep(max_age=constants.ORDER_STALE_SECONDS, batch_size=constants.ORDER_SWEEP_BATCH_SIZE):
+    """
+    分批取消过期的订单, 直到没有过期订单为止
+    每次执行后记录日志, 并将处理数量写入Redis统计
+    :param max_age: 订单的过期时间, 单位：秒
+    :return: (取消的订单数量, 批次数, 耗时)
+    """
+    started = time.time()
+    deadline = datetime.datetime.now() - datetime.timedelta(seconds=max_age)
+    count = 0
+    batches = 0
+    while True:
+        canceled = _cancel_batch(deadline, batch_size)
+        count += canceled
+        if canceled:
+            batches += 1
+        if canceled < batch_size:
+            break
+    elapsed = time.time() - started
+
+    current_app.logger.info("过期订单清理完成: 取消%d个订单, 共%d批, 耗时%.3f秒" % (count, batches, elapsed))
+    try:
+        pl = sr.pipeline()
+        pl.hset(constants.ORDER_SWEEP_STATS_REDIS_KEY, "last_run_time", int(started))
+        pl.hset(constants.ORDER_SWEEP_STATS_REDIS_KEY, "last_canceled", count)
+        pl.hset(constants.ORDER_SWEEP_STATS_REDIS_KEY, "last_elapsed", "%.3f" % elapsed)
+        pl.hincrby(constants.ORDER_SWEEP_STATS_REDIS_KEY, "total_canceled", count)
+        pl.hincrby(constants.ORDER_SWEEP_STATS_REDIS_KEY, "runs", 1)
+        pl.execute()
+    except Exception as e:
+        current_app.logger.error(e)
+    return count, batches, elapsed
@@ -0,0 +1,38 @@
+# 游标(keyset)分页工具
+# 游标记录上一页最后一条数据的排序字段值, 下一页直接从该位置往后查, 不需要OFFSET和COUNT, 翻到第N页和第1页代价相同
+import base64
+import json
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values):
+    """将上一页最后一条数据的排序字段值编码为不透明的游标字符串"""
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析游标, 格式错误时抛出ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except Exception:
+        raise ValueError("游标格式错误: %s" % cursor)
+    if not isinstance(values, list):
+        raise ValueError("游标格式错误: %s" % cursor)
+    return values
+
+
+def after_cursor(columns, values, desc=False):
+    """
+    生成"排在游标之后"的查询条件
+    (a, b) > (x, y) 展开为 a > x or (a = x and b > y), 倒序时比较方向相反
+    :param columns: 排序字段列表, 最后一个字段必须唯一(一般为主键)
+    :param values: 游标中对应字段的值
+    """
+    conditions = []
+    for i, column in enumerate(columns):
+        compare = column < values[i] if desc else column > values[i]
+        equals = [c == v for c, v in zip(columns[:i], values[:i])]
+        conditions.append(and_(*(equals + [compare])))
+    return or_(*conditions)
@@ -0,0 +1,235 @@
+# 查询计划检查
+# 用测试客户端依次请求api接口, 记录每个接口执行的SELECT语句并逐条EXPLAIN
+# 下单冲突检查和过期订单清理无法通过GET请求触发, 直接调用对应的查询函数后EXPLAIN
+# 出现预估扫描行数超过阈值的全表扫描(type为ALL)时, 视为该查询退化
+# 另外检查列表接口执行的语句数量, 语句数量随返回的条目数增长时, 说明存在逐条懒加载的N+1查询
+import datetime
+from contextlib import contextmanager
+
+from sqlalchemy import event, func
+
+from ihome import db
+from ihome.models import House, Order
+from ihome.modules.api import order as order_api
+from ihome.utils import availability, cache, catalog, constants, house_list_index, order_sweeper, pagination, \
+    search_index
+from ihome.utils.response_code import RET
+
+# 需要检查的接口: (请求身份, 地址模板), 身份为landlord或custom时以房东或房客登录
+CHECK_REQUESTS = [
+    (None, "/api/v1.0/areas"),
+    (None, "/api/v1.0/houses/index"),
+    (None, "/api/v1.0/houses/{house_id}"),
+    (None, "/api/v1.0/houses/{house_id}/comments"),
+    (None, "/api/v1.0/houses/{house_id}/calendar?month={month}"),
+    (None, "/api/v1.0/houses"),
+    (None, "/api/v1.0/houses?aid={area_id}&sk=price-inc"),
+    (None, "/api/v1.0/houses?aid={area_id}&sk=booking&p=2"),
+    (None, "/api/v1.0/houses?sk=booking&cursor={cursor}"),
+    (None, "/api/v1.0/houses?sd={sd}&ed={ed}&sk=price-des"),
+    (None, "/api/v1.0/houses?q={q}&sk=new"),
+    (None, "/api/v1.0/houses?aid={area_id}&facility=1&facets=1"),
+    ("landlord", "/api/v1.0/user/houses"),
+    ("landlord", "/api/v1.0/orders?role=landlord"),
+    ("landlord", "/api/v1.0/orders?role=landlord&status=WAIT_ACCEPT"),
+    ("custom", "/api/v1.0/orders?role=custom"),
+    ("custom", "/api/v1.0/orders?role=custom&status=COMPLETE"),
+    ("custom", "/api/v1.0/user"),
+]
+
+# 需要检查语句数量的列表接口: (请求身份, 地址, 每页条数的配置名), 配置名为None时比较房屋数量不同的房东
+QUERY_COUNT_REQUESTS = [
+    (None, "/api/v1.0/houses/index", "HOME_PAGE_MAX_HOUSES"),
+    (None, "/api/v1.0/houses?sk=booking", "HOUSE_LIST_PER_PAGE"),
+    ("landlord", "/api/v1.0/orders?role=landlord", "ORDER_LIST_PAGE_CAPACITY"),
+    ("custom", "/api/v1.0/orders?role=custom", "ORDER_LIST_PAGE_CAPACITY"),
+    ("landlord", "/api/v1.0/user/houses", None),
+]
+
+# 数据量很小的表允许全表扫描
+FULL_SCAN_ALLOWED_TABLES = ("ih_area_info", "ih_facility_info")
+
+
+@contextmanager
+def _bypass_caches():
+    """
+    检查期间绕过读穿缓存, 进程内目录, 房屋列表排序索引, 可预订索引和预订日历, 保证接口真正执行各自的数据库查询
+    否则缓存或索引有效时接口不执行对应的查询, 检查会直接通过
+    搜索接口没有数据库查询的退回方式, 关键词查询改为返回第一个房屋, 只检查之后按房屋id查询列表的语句
+    """
+    first_house_id = db.session.query(func.min(House.id)).scalar()
+    patches = [
+        (cache, "get_or_build", lambda key, expires, build: build()),
+        (catalog, "get_catalog", lambda: catalog._load(None)),
+        (house_list_index, "is_ready", lambda: False),
+        (availability, "is_ready", lambda: False),
+        (availability, "is_calendar_ready", lambda: False),
+        (search_index, "is_ready", lambda: True),
+        (search_index, "search", lambda keyword: {first_house_id}),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    try:
+        for module, name, replacement in patches:
+            setattr(module, name, replacement)
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def _explain(statement, parameters):
+    """执行EXPLAIN, 返回由字段名到值的字典组成的列表"""
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN " + statement, parameters)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _recording(statements):
+    """记录期间执行的所有SQL语句, 每项为(SQL语句, 参数)"""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _request(client, user_id, url, statements):
+    """以指定用户的身份请求接口, 返回响应, 请求前清空已记录的语句"""
+    with client.session_transaction() as session:
+        session.clear()
+        if user_id:
+            session["user_id"] = user_id
+    del statements[:]
+    return client.get(url)
+
+
+def _check_statements(name, statements, min_rows, problems):
+    """EXPLAIN记录到的SELECT语句, 将预估行数超过min_rows的全表扫描添加到problems"""
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        for plan in _explain(statement, parameters):
+            if plan.get("type") != "ALL" or plan.get("table") in FULL_SCAN_ALLOWED_TABLES:
+                continue
+            if (plan.get("rows") or 0) >= min_rows:
+                problems.append((name, statement, plan))
+
+
+def check(app, min_rows=1000):
+    """
+    请求CHECK_REQUESTS中的接口并检查其中每条查询的执行计划, 再检查下单冲突检查和过期订单清理的查询
+    :param min_rows: 全表扫描的预估行数超过该值时才报告, 小表上优化器本来就倾向于全表扫描
+    :return: 问题列表, 每项为(接口地址或函数名, SQL语句, EXPLAIN结果行)
+    """
+    house = House.query.order_by(House.id).first()
+    order = Order.query.order_by(Order.id).first()
+    if not house or not order:
+        raise ValueError("数据库中至少需要一个房屋和一个订单")
+    sd = datetime.date.today() + datetime.timedelta(days=7)
+    params = {
+        "house_id": house.id,
+        "area_id": house.area_id,
+        "cursor": pagination.encode_cursor(["booking", house.order_count, house.id]),
+        "sd": sd.strftime("%Y-%m-%d"),
+        "ed": (sd + datetime.timedelta(days=3)).strftime("%Y-%m-%d"),
+        "month": sd.strftime("%Y-%m"),
+        "q": house.title[:2],
+    }
+    begin_date = datetime.datetime.combine(sd, datetime.time())
+    # 无法通过GET请求触发的查询: (函数名, 执行查询的函数), 执行后回滚, 释放查询加的锁
+    direct_checks = [
+        ("order._booking_conflict_exists", lambda: order_api._booking_conflict_exists(
+            house.id, begin_date, begin_date + datetime.timedelta(days=3))),
+        ("order_sweeper._cancel_batch", lambda: order_sweeper._stale_batch_query(
+            datetime.datetime.now() - datetime.timedelta(seconds=constants.ORDER_STALE_SECONDS),
+            constants.ORDER_SWEEP_BATCH_SIZE).all()),
+    ]
+    users = {"landlord": house.user_id, "custom": order.user_id}
+
+    # 使房屋列表的结果缓存失效, 保证接口真正执行数据库查询
+    cache.bump_version("house_list")
+
+    problems = []
+    client = app.test_client()
+    statements = []
+    with _bypass_caches(), _recording(statements):
+        for role, url in CHECK_REQUESTS:
+            url = url.format(**params)
+            _request(client, users.get(role), url, statements)
+            _check_statements(url, list(statements), min_rows, problems)
+
+        for name, run_query in direct_checks:
+            del statements[:]
+            try:
+                run_query()
+            finally:
+                db.session.rollback()
+            _check_statements(name, list(statements), min_rows, problems)
+    return problems
+
+
+def _landlords_by_house_count():
+    """房屋最少和最多的房东id, 没有房屋时返回None"""
+    counts = db.session.query(House.user_id, func.count(House.id)).group_by(House.user_id) \
+        .order_by(func.count(House.id), House.user_id).all()
+    if not counts:
+        return None
+    return counts[0][0], counts[-1][0]
+
+
+def check_query_count(app):
+    """
+    检查列表接口执行的语句数量是否随返回的条目数变化(逐条懒加载关联数据的N+1查询)
+    分页接口分别以每页1条和配置的每页条数请求, 房东的房屋列表分别以房屋最少和最多的房东请求
+    两次请求返回的条目数相同时无法比较, 同样作为问题报告, 需要补充测试数据后重新检查
+    :return: 问题列表, 每项为(接口地址, 原因, [(条目数, 语句数量), ...]), 原因为changed, unverified或failed
+    """
+    order = Order.query.order_by(Order.id).first()
+    landlords = _landlords_by_house_count()
+    if not landlords or not order:
+        raise ValueError("数据库中至少需要一个房屋和一个订单")
+    users = {"landlord": landlords[1], "custom": order.user_id}
+
+    problems = []
+    client = app.test_client()
+    statements = []
+    with _bypass_caches(), _recording(statements):
+        for role, url, page_size_name in QUERY_COUNT_REQUESTS:
+            counts = []
+            if page_size_name:
+                # 分页接口: 修改每页条数
+                page_size = getattr(constants, page_size_name)
+                variants = [(users.get(role), 1), (users.get(role), page_size)]
+            else:
+                variants = [(user_id, None) for user_id in landlords]
+            try:
+                for user_id, size in variants:
+                    if size:
+                        setattr(constants, page_size_name, size)
+                    cache.bump_version("house_list")
+                    resp_dict = _request(client, user_id, url, statements).get_json()
+                    if not resp_dict or resp_dict.get("errno") != RET.OK:
+                        break
+                    data = resp_dict["data"]
+                    items = data if isinstance(data, list) else data.get("houses", data.get("orders", []))
+                    counts.append((len(items), len(statements)))
+            finally:
+                if page_size_name:
+                    setattr(constants, page_size_name, page_size)
+
+            if len(counts) < len(variants):
+                problems.append((url, "failed", counts))
+            elif len(set(item_count for item_count, _ in counts)) < len(counts):
+                problems.append((url, "unverified", counts))
+            elif len(set(statement_count for _, statement_count in counts)) > 1:
+                problems.append((url, "changed", counts))
+    return problems
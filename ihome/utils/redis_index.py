@@ -0,0 +1,40 @@
+# Redis索引的公共重建流程
+# 可预订索引, 预订日历, 房屋列表排序索引和搜索索引都由数据库中的数据派生, 重建方式相同:
+# 先删除完成标记和旧数据, 再分批读取数据库写入Redis, 最后写入完成标记
+# 完成标记不存在时索引不完整, 使用索引的地方应退回到数据库查询
+from ihome import sr
+from ihome.utils import constants
+
+
+def is_ready(ready_key):
+    return bool(sr.exists(ready_key))
+
+
+def rebuild(prefix, ready_key, query, add):
+    """
+    重建一个Redis索引
+    1. 删除完成标记, 重建期间调用者直接查询数据库
+    2. 删除键前缀下已有的数据
+    3. 分批读取query的结果, 调用add写入, 每批执行一次pipeline
+    4. 写入完成标记
+    :param prefix: 索引的Redis键前缀
+    :param ready_key: 完成标记的Redis键
+    :param query: 查询索引数据的SQLAlchemy查询
+    :param add: add(row, pipeline) 将一行数据写入索引的命令追加到pipeline中
+    :return: 写入的行数
+    """
+    batch_size = constants.REDIS_INDEX_REBUILD_BATCH_SIZE
+    sr.delete(ready_key)
+    for key in sr.scan_iter(match=prefix + "*", count=batch_size):
+        sr.delete(key)
+
+    count = 0
+    pl = sr.pipeline()
+    for row in query.yield_per(batch_size):
+        add(row, pl)
+        count += 1
+        if count % batch_size == 0:
+            pl.execute()
+    pl.set(ready_key, 1)
+    pl.execute()
+    return count
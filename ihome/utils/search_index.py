@@ -0,0 +1,80 @@
+# 房屋标题和地址的倒排索引
+# 中文没有空格分词, 对连续的汉字按单字和相邻两字(二元组)建索引, 字母和数字按整个单词建索引
+# 搜索时将关键词按相同规则切分, 对各个词的房屋id集合求交集, 不需要在数据库中做 LIKE '%...%' 扫描
+import re
+
+from ihome import sr
+from ihome.models import House
+from ihome.utils import constants, redis_index
+
+# 连续的汉字, 或者连续的字母和数字
+WORD_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[0-9a-z]+")
+
+# 索引建立完成的标记, 词中不会出现下划线, 不会与词的键冲突
+READY_KEY = constants.HOUSE_SEARCH_INDEX_REDIS_PREFIX + "index_ready"
+
+
+def _key(token):
+    return constants.HOUSE_SEARCH_INDEX_REDIS_PREFIX + token
+
+
+def _is_cjk(word):
+    return word[0] >= "\u3400"
+
+
+def tokenize(text, for_query=False):
+    """
+    切分文本
+    建索引时每段汉字产生全部单字和二元组, 查询时只取二元组(只有一个字时取单字), 减少求交集的集合数量
+    :return: 词的集合
+    """
+    tokens = set()
+    for word in WORD_RE.findall((text or "").lower()):
+        if not _is_cjk(word):
+            tokens.add(word)
+            continue
+        bigrams = {word[i:i + 2] for i in range(len(word) - 1)}
+        if not for_query:
+            tokens.update(word)
+            tokens.update(bigrams)
+        elif bigrams:
+            tokens.update(bigrams)
+        else:
+            tokens.add(word)
+    return tokens
+
+
+def add_house(house, pipeline=None):
+    """
+    将房屋的标题和地址加入索引
+    :param pipeline: 传入时只追加命令, 由调用者统一执行
+    """
+    pl = pipeline if pipeline is not None else sr.pipeline()
+    for token in tokenize(house.title) | tokenize(house.address):
+        pl.sadd(_key(token), house.id)
+    if pipeline is None:
+        pl.execute()
+
+
+def is_ready():
+    return redis_index.is_ready(READY_KEY)
+
+
+def search(keyword):
+    """
+    查询标题或地址中包含关键词的房屋
+    :return: 房屋id集合
+    """
+    tokens = tokenize(keyword, for_query=True)
+    if not tokens:
+        return set()
+    return {int(house_id) for house_id in sr.sinter([_key(token) for token in tokens])}
+
+
+def rebuild():
+    """
+    根据房屋表重建倒排索引
+    :return: 写入的房屋数量
+    """
+    houses = House.query.with_entities(House.id, House.title, House.address)
+    return redis_index.rebuild(constants.HOUSE_SEARCH_INDEX_REDIS_PREFIX, READY_KEY, houses, add_house)
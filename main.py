@@ -11,5 +11,92 @@ mgr = Manager(app)
 mgr.add_command("mc", MigrateCommand)
 
 
+# 根据订单表重建房屋可预订索引
+@mgr.command
+def rebuild_availability():
+    from ihome.utils import availability
+    count = availability.rebuild()
+    print("可预订索引重建完成, 共写入%d条订单" % count)
+
+
+# 根据订单表重建各房屋的预订日历位图
+@mgr.command
+def rebuild_house_calendar():
+    from ihome.utils import availability
+    count = availability.rebuild_calendar()
+    print("预订日历重建完成, 共写入%d条订单" % count)
+
+
+# 根据房屋表重建房屋列表排序索引
+@mgr.command
+def rebuild_house_list_index():
+    from ihome.utils import house_list_index
+    count = house_list_index.rebuild()
+    print("房屋列表排序索引重建完成, 共写入%d个房屋" % count)
+
+
+# 根据房屋表重建房屋搜索倒排索引
+@mgr.command
+def rebuild_search_index():
+    from ihome.utils import search_index
+    count = search_index.rebuild()
+    print("房屋搜索索引重建完成, 共写入%d个房屋" % count)
+
+
+# 检查api接口执行的查询语句是否退化为全表扫描, 发现问题时以非0状态码退出
+@mgr.option("-r", "--min-rows", dest="min_rows", type=int, default=1000, help="报告全表扫描的最小预估行数")
+def check_query_plan(min_rows):
+    from ihome.utils import query_plan
+    problems = query_plan.check(app, min_rows)
+    for url, statement, plan in problems:
+        print("%s 全表扫描 %s, 预估%s行:\n%s\n" % (url, plan["table"], plan["rows"], statement))
+    if problems:
+        raise SystemExit(1)
+    print("查询计划检查通过")
+
+
+# 检查列表接口的SQL语句数量是否随返回的条目数变化(N+1查询), 存在问题时以非0状态码退出
+@mgr.command
+def check_query_count():
+    from ihome.utils import query_plan
+    problems = query_plan.check_query_count(app)
+    reasons = {
+        "changed": "语句数量随条目数变化",
+        "unverified": "各次请求返回的条目数相同, 未能验证, 请补充测试数据",
+        "failed": "请求失败",
+    }
+    for url, reason, counts in problems:
+        print("%s %s: %s" % (url, reasons[reason], ", ".join("%d条%d次" % item for item in counts)))
+    if problems:
+        raise SystemExit(1)
+    print("语句数量检查通过")
+
+
+# 取消超时未处理的待接单和待支付订单, 由定时任务定期执行
+@mgr.option("-a", "--max-age", dest="max_age", type=int, default=None, help="订单的过期时间, 单位：秒")
+@mgr.option("-b", "--batch-size", dest="batch_size", type=int, default=None, help="每批处理的订单数")
+def cancel_stale_orders(max_age, batch_size):
+    from ihome.utils import constants, order_sweeper
+    count, batches, elapsed = order_sweeper.sweep(max_age or constants.ORDER_STALE_SECONDS,
+                                                  batch_size or constants.ORDER_SWEEP_BATCH_SIZE)
+    print("过期订单清理完成, 共取消%d个订单, %d批, 耗时%.3f秒" % (count, batches, elapsed))
+
+
+# 修改城区或设施后, 通知各进程重新加载目录
+@mgr.command
+def reload_catalog():
+    from ihome.utils import catalog
+    catalog.reload()
+    print("已通知各进程重新加载城区和设施目录")
+
+
+# 查看各层缓存的命中率
+@mgr.command
+def cache_stats():
+    from ihome.utils import cache
+    for tier, (hit, miss, rate) in sorted(cache.get_stats().items()):
+        print("%s: 命中%d次, 未命中%d次, 命中率%.2f%%" % (tier, hit, miss, rate * 100))
+
+
 if __name__ == '__main__':
     mgr.run()
@@ -0,0 +1,41 @@
+"""add query indexes
+
+Revision ID: 282b07fdda16
+Revises: b566cb11afc1
+Create Date: 2026-10-18 11:03:47.218554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '282b07fdda16'
+down_revision = 'b566cb11afc1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_ih_house_info_user_id'), 'ih_house_info', ['user_id'], unique=False)
+    op.create_index(op.f('ix_ih_house_info_price'), 'ih_house_info', ['price'], unique=False)
+    op.create_index(op.f('ix_ih_house_info_acreage'), 'ih_house_info', ['acreage'], unique=False)
+    op.create_index(op.f('ix_ih_house_info_order_count'), 'ih_house_info', ['order_count'], unique=False)
+    op.create_index('ix_ih_house_info_area_id_price', 'ih_house_info', ['area_id', 'price'], unique=False)
+    op.create_index('ix_ih_house_info_area_id_order_count', 'ih_house_info', ['area_id', 'order_count'], unique=False)
+    op.create_index('ix_ih_house_info_area_id_acreage', 'ih_house_info', ['area_id', 'acreage'], unique=False)
+    op.create_index(op.f('ix_ih_order_info_user_id'), 'ih_order_info', ['user_id'], unique=False)
+    op.create_index('ix_ih_order_info_house_id_begin_date_end_date', 'ih_order_info',
+                    ['house_id', 'begin_date', 'end_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_ih_order_info_house_id_begin_date_end_date', table_name='ih_order_info')
+    op.drop_index(op.f('ix_ih_order_info_user_id'), table_name='ih_order_info')
+    op.drop_index('ix_ih_house_info_area_id_acreage', table_name='ih_house_info')
+    op.drop_index('ix_ih_house_info_area_id_order_count', table_name='ih_house_info')
+    op.drop_index('ix_ih_house_info_area_id_price', table_name='ih_house_info')
+    op.drop_index(op.f('ix_ih_house_info_order_count'), table_name='ih_house_info')
+    op.drop_index(op.f('ix_ih_house_info_acreage'), table_name='ih_house_info')
+    op.drop_index(op.f('ix_ih_house_info_price'), table_name='ih_house_info')
+    op.drop_index(op.f('ix_ih_house_info_user_id'), table_name='ih_house_info')
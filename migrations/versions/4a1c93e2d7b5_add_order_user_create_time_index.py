@@ -0,0 +1,27 @@
+"""add order user_id create_time index
+
+Revision ID: 4a1c93e2d7b5
+Revises: 282b07fdda16
+Create Date: 2026-10-18 14:26:05.734912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a1c93e2d7b5'
+down_revision = '282b07fdda16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 先建组合索引, user_id的外键约束需要一个以user_id开头的索引
+    op.create_index('ix_ih_order_info_user_id_create_time', 'ih_order_info', ['user_id', 'create_time'], unique=False)
+    op.drop_index('ix_ih_order_info_user_id', table_name='ih_order_info')
+
+
+def downgrade():
+    op.create_index('ix_ih_order_info_user_id', 'ih_order_info', ['user_id'], unique=False)
+    op.drop_index('ix_ih_order_info_user_id_create_time', table_name='ih_order_info')
@@ -0,0 +1,26 @@
+"""add order status create_time index
+
+Revision ID: 9d3e5b7c1f20
+Revises: 4a1c93e2d7b5
+Create Date: 2026-10-18 15:02:41.518377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3e5b7c1f20'
+down_revision = '4a1c93e2d7b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_ih_order_info_status_create_time', 'ih_order_info', ['status', 'create_time'], unique=False)
+    op.drop_index('ix_ih_order_info_status', table_name='ih_order_info')
+
+
+def downgrade():
+    op.create_index('ix_ih_order_info_status', 'ih_order_info', ['status'], unique=False)
+    op.drop_index('ix_ih_order_info_status_create_time', table_name='ih_order_info')
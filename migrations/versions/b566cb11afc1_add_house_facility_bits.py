@@ -0,0 +1,30 @@
+"""add house facility_bits
+
+Revision ID: b566cb11afc1
+Revises: f8a140b1b08c
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b566cb11afc1'
+down_revision = 'f8a140b1b08c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('ih_house_info', sa.Column('facility_bits', sa.BigInteger(), nullable=True))
+    # 根据已有的房屋设施关系回填设施位图, 第(设施编号-1)位为1表示有该设施
+    op.execute(
+        "UPDATE ih_house_info SET facility_bits = ("
+        "SELECT COALESCE(SUM(1 << (facility_id - 1)), 0) FROM ih_house_facility "
+        "WHERE ih_house_facility.house_id = ih_house_info.id)"
+    )
+
+
+def downgrade():
+    op.drop_column('ih_house_info', 'facility_bits')
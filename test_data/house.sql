@@ -1 +1 @@
-INSERT INTO `ih_house_info` VALUES ('2018-11-10 23:01:40','2018-11-10 23:03:45',1,7,3,'国贸CBD三里屯地铁阳光超赞大卧室',21600,'北京市朝阳区建国路100号西段',1,16,'3室1厅1卫1厨1阳台',2,'双人床：1.8m宽 × 2m长 ×1张',10000,1,0,0,'Fo6ctwNltpBXnp9B9E68GHKeEzZs'),('2018-11-10 23:08:54','2018-11-10 23:09:55',2,7,6,'杂志屋 @北京南站',34900,'北京市丰台区世纪金色嘉园',1,25,'1室0厅1卫0厨0阳台',2,'双人床：1.5m宽 × 1.9m长 ×1张',10000,1,0,0,'FmhmigZWt0qhebK0JlxVQ4UUpAzK'),('2018-11-10 23:12:34','2018-11-10 23:13:47',3,7,1,'798酒仙桥望京14号线—艺术温馨的电影小屋',34900,'北京市东城区荧屏里',1,65,'1室1厅1卫1厨1阳台',2,'双人床：1.8m宽 × 2m长 ×1张',10000,1,0,0,'Fus1XjhmMMe9Vl733O8-UHkLeF4A');
\ No newline at end of file
+INSERT INTO `ih_house_info` VALUES ('2018-11-10 23:01:40','2018-11-10 23:03:45',1,7,3,'国贸CBD三里屯地铁阳光超赞大卧室',21600,'北京市朝阳区建国路100号西段',1,16,'3室1厅1卫1厨1阳台',2,'双人床：1.8m宽 × 2m长 ×1张',10000,1,0,0,'Fo6ctwNltpBXnp9B9E68GHKeEzZs',0),('2018-11-10 23:08:54','2018-11-10 23:09:55',2,7,6,'杂志屋 @北京南站',34900,'北京市丰台区世纪金色嘉园',1,25,'1室0厅1卫0厨0阳台',2,'双人床：1.5m宽 × 1.9m长 ×1张',10000,1,0,0,'FmhmigZWt0qhebK0JlxVQ4UUpAzK',0),('2018-11-10 23:12:34','2018-11-10 23:13:47',3,7,1,'798酒仙桥望京14号线—艺术温馨的电影小屋',34900,'北京市东城区荧屏里',1,65,'1室1厅1卫1厨1阳台',2,'双人床：1.8m宽 × 2m长 ×1张',10000,1,0,0,'Fus1XjhmMMe9Vl733O8-UHkLeF4A',0);
\ No newline at end of file